@@ -1,7 +1,7 @@
 import numpy as np
 import os
-from Model.Processes import ToGreyscale, ToOneBit, AddNoise, Crop, Compress, ScaleUp, MakeNetwork, MakeAnimation
-from Model.functions.imToRgb import getImages
+from Model.Processes import Pipeline, ToGreyscale, ToOneBit, AddNoise, Crop, Compress, ScaleUp, MakeNetwork, MakeAnimation
+from Model.functions.imToRgb import LazyImages
 from Model.functions.RgbToIm import saveImages
 from Model.functions.main import generatePatterns, makeNetwork, saveNetwork
 
@@ -52,12 +52,13 @@ class ProcessImagesApp:
         self.image_folder = image_folder
         self.save_folder = save_folder
         self.options = ['Convert to greyscale', 'Convert to one-bit', 'Add noise',
-                        'Crop', 'Compress', 'Scale up']
+                        'Crop', 'Compress', 'Scale up', 'Run queued steps']
         if rgbs is None:
-            self.image_batch = getImages(image_folder)
+            self.image_batch = LazyImages(image_folder)
         else:
             self.image_batch = rgbs
         self.process = None
+        self.pipeline = Pipeline()
     
     def is_valid_option(self,value):
         try:
@@ -96,14 +97,18 @@ class ProcessImagesApp:
     def reset_field(self, field_name):
         self.process.reset_value(field_name)
 
-    def run_process(self):
-        processed_batch = []
-        for rgb in self.image_batch:
-            processed_batch.append(self.process.run(rgb))
-        self.image_batch = processed_batch
+    def add_step(self):
+        self.pipeline.add(self.process)
+        self.process = None
 
-    def save_batch(self):
-        saveImages(self.image_batch, self.save_folder)
+    def run_pipeline(self):
+        if isinstance(self.image_batch, LazyImages):
+            # reads, runs every queued step and writes each image in one worker, straight from the import folder
+            self.pipeline.run_folder(self.image_folder, self.save_folder)
+        else:
+            self.image_batch = self.pipeline.run_batch(self.image_batch)
+            saveImages(self.image_batch, self.save_folder)
+        self.pipeline.clear()
 
     
     def generate_patterns(self):
@@ -1,5 +1,6 @@
 from Model.functions.rgbArrays import *
 from Model.functions.main import makeNetworkFromFolder, makeNetworkAnimation
+from Model.functions.pipeline import runSteps, stepsOf, processBatch, processFolder
 from functools import partial
 
 
@@ -93,6 +94,30 @@ class ScaleUp(RgbProcess):
         super().__init__(func, args)
 
 
+class Pipeline:
+    def __init__(self, processes = None) -> None:
+        self.processes = [] if processes is None else list(processes)
+
+    @property
+    def names(self):
+        return [type(process).__name__ for process in self.processes]
+
+    def add(self, process):
+        self.processes.append(process)
+
+    def clear(self):
+        self.processes = []
+
+    def run(self, rgb):
+        return runSteps(rgb, stepsOf(self.processes))
+
+    def run_batch(self, rgbs, workers = None, chunk_size = None):
+        return processBatch(rgbs, stepsOf(self.processes), workers, chunk_size)
+
+    def run_folder(self, import_folder, save_folder, workers = None, chunk_size = None):
+        return processFolder(import_folder, save_folder, stepsOf(self.processes), workers, chunk_size)
+
+
 class NetworkProcess:
     def __init__(self, func, args) -> None:
         self.func = func
@@ -133,7 +158,9 @@ class MakeNetwork(NetworkProcess):
                          float, 'Please enter a decimal value bewteen 0.3 and 0.5'),
                 Argument('density', partial(check_float, minimum = 0.2, maximum = 1),
                          float, 'Please enter a decimal value bewteen 0.2 and 1'),
-                Argument('name', lambda x : True, lambda x : x, 'Network Name')]
+                Argument('name', lambda x : True, lambda x : x, 'Network Name'),
+                Argument('filter_mode', filter_mode_checker, lambda x : x,
+                         'Enter one of the following: exact, lsh, online')]
         super().__init__(func, args)
 
 class MakeAnimation(NetworkProcess):
@@ -160,6 +187,11 @@ def ref_pt_checker(value):
         return True
     return False
 
+def filter_mode_checker(value):
+    if value in ['exact', 'lsh', 'online']:
+        return True
+    return False
+
 def check_int(value, minimum = None, maximum = None):
     try:
         int(value)
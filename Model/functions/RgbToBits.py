@@ -7,3 +7,15 @@ def rgbToBits(rgb_array: np.array) -> np.array:
     oneBit = rgb.toOneBit(rgb_array)
     reds = np.clip(oneBit[:, :, 0], 0, 1)
     return reds.flatten(order='C').astype(int)
+
+
+def tileBits(rgb_array: np.array, shape: tuple[int], stride: tuple[int] = None,
+             offset: tuple[int] = (0, 0)) -> np.array:
+    # rgbToBits of every tile at once, one row per tile in tiles() order
+    h, w = shape
+    if rgb_array.shape[0] < offset[0] + h or rgb_array.shape[1] < offset[1] + w:
+        return np.zeros((0, h * w), dtype=np.uint8)
+    windows = rgb.tileView(rgb.greyValues(rgb_array), shape, stride, offset)
+    sums = windows.sum(axis=(2, 3), dtype=np.int64)
+    bits = np.multiply(windows, h * w, dtype=np.int32) >= sums[:, :, np.newaxis, np.newaxis]
+    return bits.reshape(-1, h * w).astype(np.uint8)
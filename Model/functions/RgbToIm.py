@@ -2,6 +2,8 @@ import os
 from typing import NewType
 from nptyping import NDArray, UInt8, Shape
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from Model.functions.imToRgb import ioWorkers
 import numpy as np
 
 
@@ -29,29 +31,46 @@ def hasImageExt(string: str) -> bool:
 
 ## Saving Data ##
 
+pngLevel = 6
+
+
 
 def saveImage(rgb_array: rgb, name: fileName, path: str = '') -> None:
     if not hasImageExt(name):
         name = name + '.png'
-    start = os.getcwd()
-    os.chdir(f'{start}/{path}')
+    writeImage(rgb_array, os.path.join(path, name))
+
+
+def writeImage(rgb_array: rgb, file: str, compressLevel: int = None) -> None:
     image = Image.fromarray(rgb_array.astype(np.uint8), mode='RGB')
-    image.save(name)
-    os.chdir(start)
+    # compress_level only means something to the png encoder, the others ignore it
+    image.save(file, compress_level=pngLevel if compressLevel is None else compressLevel)
+
+
+def writeImages(rgb_arrays: list, files: list[str], workers: int = None, compressLevel: int = None) -> None:
+    workers = workers or ioWorkers
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for rgb_array, file in zip(rgb_arrays, files):
+            # only a couple of images per thread are held at once, a lazy batch is never decoded whole
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(executor.submit(writeImage, rgb_array, file, compressLevel))
+        for future in pending:
+            future.result()
 
 
-def saveImages(oneBits: list, path: str) -> None:
-    for i, rgb_array in enumerate(oneBits):
-        saveImage(rgb_array, f'{i}', path)
+def saveImages(oneBits: list, path: str, workers: int = None, compressLevel: int = None) -> None:
+    path = os.path.abspath(path)
+    writeImages(oneBits, (os.path.join(path, f'{i}.png') for i in range(len(oneBits))), workers, compressLevel)
 
 
 def saveGif(trgb_array: rgb, name: str, path: str = '', fps: int = 30) -> None:
-    start = os.getcwd()
-    os.chdir(f'{start}/{path}')
     nFrames = trgb_array.shape[0]
     duration = nFrames / fps
     imageList = [Image.fromarray(trgb_array[t, :, :, :])
                  for t in range(nFrames)]
-    imageList[0].save(f'{name}.gif', save_all=True,
+    imageList[0].save(os.path.join(path, f'{name}.gif'), save_all=True,
                       append_images=imageList[1:], optimize=False, duration=nFrames / fps, loop=0)
-    os.chdir(start)
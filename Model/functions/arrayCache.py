@@ -0,0 +1,123 @@
+import hashlib
+import os
+import threading
+import numpy as np
+from Model.functions.bitArrays import packBits
+from Model.functions.imToRgb import readImage
+from Model.functions.RgbToBits import tileBits
+
+
+## Settings ##
+cacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'hopfield_arrays')
+cacheBytes = 2 * 1024 ** 3
+
+
+## Keys ##
+def cacheKey(file: str, *parts) -> str:
+    # the file is identified by where it is and when it last changed, never by reading it
+    stat = os.stat(file)
+    fields = [os.path.abspath(file), stat.st_mtime_ns, stat.st_size] + [repr(part) for part in parts]
+    return hashlib.sha1('|'.join(map(str, fields)).encode()).hexdigest()
+
+
+def cachePath(key: str) -> str:
+    return os.path.join(cacheDir, f'{key}.npy')
+
+
+## Storage ##
+# bytes this process last knew the cache to hold plus what it wrote since, None until the first scan
+usage = None
+usageLock = threading.Lock()
+
+
+def scanCache() -> list[tuple[int, int, str]]:
+    # (mtime, size, path) of every entry, ones another thread or process removes mid scan are skipped
+    if not os.path.isdir(cacheDir):
+        return []
+    entries = []
+    for entry in os.scandir(cacheDir):
+        if not entry.name.endswith('.npy'):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    return entries
+
+
+def cacheSize() -> int:
+    return sum(size for _, size, _ in scanCache())
+
+
+def evictCache(limit: int = None) -> None:
+    # least recently used first, a hit bumps the file's mtime
+    global usage
+    limit = cacheBytes if limit is None else limit
+    entries = sorted(scanCache())
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    usage = total
+
+
+def clearCache() -> None:
+    evictCache(0)
+
+
+def reserveCache(nbytes: int) -> None:
+    # a miss only rescans the folder once the running total would pass the limit
+    global usage
+    with usageLock:
+        if usage is None or usage + nbytes > cacheBytes:
+            evictCache(cacheBytes - nbytes)
+        usage += nbytes
+
+
+def cached(key: str, compute: 'function') -> np.array:
+    file = cachePath(key)
+    try:
+        array = np.load(file, mmap_mode='r')
+        os.utime(file)
+        return array
+    except (FileNotFoundError, ValueError):
+        pass
+    array = np.ascontiguousarray(compute())
+    if array.nbytes > cacheBytes:
+        return array
+    reserveCache(array.nbytes)
+    os.makedirs(cacheDir, exist_ok=True)
+    # written under a temporary name so a reader never maps a half written file
+    temp = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp, 'wb') as out:
+        np.save(out, array)
+    os.replace(temp, file)
+    try:
+        return np.load(file, mmap_mode='r')
+    except FileNotFoundError:
+        # another thread already evicted it, the computed array is just as good
+        return array
+
+
+## Images ##
+def cachedImage(file: str) -> np.array:
+    return cached(cacheKey(file, 'rgb'), lambda: readImage(file))
+
+
+def cachedTileBits(file: str, shape: tuple[int], stride: tuple[int] = None, threshold: str = 'mean',
+                   cacheRgb: bool = False) -> np.array:
+    match threshold:
+        case 'mean':
+            toBits = tileBits
+        case _:
+            raise Exception(f'{threshold} is not a recognised threshold mode')
+    key = cacheKey(file, 'tileBits', tuple(shape), None if stride is None else tuple(stride), threshold)
+    # the decoded image is many times the packed bits, keeping it only pays when other tile shapes follow
+    source = cachedImage if cacheRgb else readImage
+    return cached(key, lambda: packBits(toBits(source(file), shape, stride)))
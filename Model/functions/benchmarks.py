@@ -0,0 +1,475 @@
+import math
+import os
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import numpy as np
+import Model.functions.hopfield as hopfield
+from Model.functions.hopfield import DiscreteHopfield, bitsToIsing, hebbWeights
+from Model.functions.bitArrays import packBits
+from Model.functions.patternFiltering import findSiblings, findSiblingDict, filterSiblings, \
+    siblingGraph, lshSiblingGraph, selectPatterns
+from Model.functions.main import iterTileBits, makeNetworkFromFolder, makeNetworkAnimation, loadNetwork
+from Model.functions.rgbArrays import continuousScale, toGreyscale, compress, toOneBit, toOneBitMedian, \
+    multContrast, toGreyscaleInPlace, toOneBitInPlace, multContrastInPlace
+from Model.functions.imToRgb import getImages, readImage
+from Model.functions.RgbToIm import saveImage, saveImages, writeImage
+from Model.functions.pipeline import processFolder
+
+
+rng = np.random.default_rng()
+
+
+## Timing ##
+def timeCall(func: 'function', *args, repeats: int = 1) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def printRow(cells: list, width: int = 12) -> None:
+    print(''.join(str(cell).rjust(width) for cell in cells))
+
+
+## Hebbian Training ##
+def hebbWeightsLoop(isingPatterns: np.array) -> np.array:
+    size = isingPatterns.shape[1]
+    weights = np.zeros((size, size))
+    for i in range(size):
+        j = i+1
+        while j < size:
+            w = (isingPatterns[:, i] @ isingPatterns[:, j]) / size
+            weights[i, j] = w
+            weights[j, i] = w
+            j += 1
+    return weights
+
+
+def checkHebbWeights(isingPatterns: np.array) -> None:
+    if not np.array_equal(hebbWeightsLoop(isingPatterns), hebbWeights(isingPatterns)):
+        raise Exception('blas hebbian weights differ from the loop')
+
+
+def benchHebbTrain(sizes: list[int] = (100, 400, 900, 2500), counts: list[int] = (5, 20, 80),
+                   loopLimit: int = 900) -> None:
+    printRow(['N', 'P', 'loop (s)', 'blas (s)', 'speedup'])
+    for size in sizes:
+        for count in counts:
+            patterns = rng.integers(2, size=(count, size))
+            isingPatterns = bitsToIsing(patterns)
+            network = DiscreteHopfield(size)
+            blas = timeCall(network.hebbTrainDense, patterns, repeats=3)
+            if size <= loopLimit:
+                checkHebbWeights(isingPatterns)
+                loop = timeCall(hebbWeightsLoop, isingPatterns)
+                printRow([size, count, f'{loop:.4f}', f'{blas:.4f}', f'{loop / blas:.0f}x'])
+            else:
+                printRow([size, count, '-', f'{blas:.4f}', '-'])
+
+
+## Compact Weights ##
+def benchCompact(sizes: list[int] = (900, 2500, 4900), counts: list[int] = (20, 200),
+                 steps: int = 5000) -> None:
+    printRow(['N', 'P', 'float (MB)', 'int (MB)', 'ratio', 'float (s)', 'int (s)', 'equal'])
+    for size in sizes:
+        for count in counts:
+            patterns = rng.integers(2, size=(count, size))
+            networks = []
+            for compact in (False, True):
+                network = DiscreteHopfield(size)
+                network.hebbTrain(patterns, compact=compact)
+                network.setTemp(0.1)
+                network.setToPattern(0)
+                networks.append(network)
+            floatNet, intNet = networks
+            floatBytes = floatNet.weights.nbytes + floatNet.state.nbytes
+            intBytes = intNet.weights.nbytes + intNet.state.nbytes
+            floatTime = timeCall(floatNet.iterate, steps)
+            intTime = timeCall(intNet.iterate, steps)
+            intNet.state = floatNet.state.copy()
+            intNet.refreshField()
+            equal = np.allclose(floatNet.activation(), intNet.activation())
+            printRow([size, count, f'{floatBytes / 2**20:.1f}', f'{intBytes / 2**20:.1f}',
+                      f'{floatBytes / intBytes:.1f}x', f'{floatTime:.4f}', f'{intTime:.4f}', equal])
+
+
+## Sibling Filtering ##
+def findSiblingDictLoop(patterns: list[np.array], size: int, cutoff: float = 0.4) -> dict[int, set[int]]:
+    return {i: findSiblings(patterns, i, size, cutoff) for i in range(len(patterns))}
+
+
+def randomTiles(count: int, size: int, nFamilies: int = 50, flipChance: float = 0.2) -> np.array:
+    families = rng.integers(2, size=(nFamilies, size))
+    bits = families[rng.integers(nFamilies, size=count)]
+    flips = rng.random(bits.shape) < flipChance
+    return packBits(bits ^ flips)
+
+
+def checkSiblingDict(patterns: list[np.array], size: int, cutoff: float = 0.4) -> None:
+    if findSiblingDictLoop(patterns, size, cutoff) != findSiblingDict(patterns, size, cutoff):
+        raise Exception('blocked sibling search differs from the loop')
+
+
+def benchSiblings(counts: list[int] = (500, 2000, 8000), size: int = 400,
+                  cutoff: float = 0.4, loopLimit: int = 2000) -> None:
+    printRow(['P', 'N', 'loop (s)', 'blocked (s)', 'speedup'])
+    for count in counts:
+        patterns = list(randomTiles(count, size))
+        blocked = timeCall(findSiblingDict, patterns, size, cutoff)
+        if count <= loopLimit:
+            checkSiblingDict(patterns, size, cutoff)
+            loop = timeCall(findSiblingDictLoop, patterns, size, cutoff)
+            printRow([count, size, f'{loop:.4f}', f'{blocked:.4f}', f'{loop / blocked:.0f}x'])
+        else:
+            printRow([count, size, '-', f'{blocked:.4f}', '-'])
+
+
+def filterSiblingsSorted(patterns: list[np.array], size: int, cutoff: float = 0.4) -> list[np.array]:
+    siblingDict = findSiblingDict(patterns, size, cutoff)
+    siblingList = [{'set': siblingDict[i], 'idx': i}
+                   for i in range(len(patterns)) if len(siblingDict[i]) > 1]
+    onlyChildren = [{'set': siblingDict[i], 'idx': i}
+                    for i in range(len(patterns)) if len(siblingDict[i]) == 1]
+
+    while True:
+        if len(siblingList) == 0:
+            break
+        siblingList.sort(key=lambda dct: len(dct['set']), reverse=True)
+        siblings, idx = siblingList[0].values()
+        if len(siblings) > 1:
+            siblingList.pop(0)
+            siblings.remove(idx)
+            for i in siblings:
+                siblingDict[i].remove(idx)
+        else:
+            break
+    siblingList.extend(onlyChildren)
+    return [patterns[dct['idx']] for dct in siblingList]
+
+
+def checkFilter(patterns: list[np.array], size: int, cutoff: float = 0.4) -> None:
+    # the heap selection must return the same patterns in the same order as the sorting one
+    kept, expected = filterSiblings(patterns, size, cutoff), filterSiblingsSorted(patterns, size, cutoff)
+    if len(kept) != len(expected) or not np.array_equal(np.stack(kept), np.stack(expected)):
+        raise Exception('heap sibling filter kept different patterns from the sorting one')
+
+
+def benchFilter(counts: list[int] = (200, 1000, 4000), size: int = 100, cutoff: float = 0.4,
+                sortedLimit: int = 4000) -> None:
+    printRow(['P', 'families', 'kept', 'sorted (s)', 'heap (s)', 'speedup'])
+    for count in counts:
+        for nFamilies in (5, count // 10, count // 2):
+            patterns = list(randomTiles(count, size, nFamilies))
+            heap = timeCall(filterSiblings, patterns, size, cutoff)
+            kept = filterSiblings(patterns, size, cutoff)
+            if count <= sortedLimit:
+                checkFilter(patterns, size, cutoff)
+                loop = timeCall(filterSiblingsSorted, patterns, size, cutoff)
+                printRow([count, nFamilies, len(kept), f'{loop:.4f}', f'{heap:.4f}', f'{loop / heap:.0f}x'])
+            else:
+                printRow([count, nFamilies, len(kept), '-', f'{heap:.4f}', '-'])
+
+
+def checkRegressions(size: int = 100, counts: list[int] = (50, 200), cutoff: float = 0.4) -> None:
+    # the untimed checks on small inputs, each raises on the first mismatch
+    for count in counts:
+        checkHebbWeights(bitsToIsing(rng.integers(2, size=(count // 10, size))))
+        for nFamilies in (5, count // 10, count // 2):
+            patterns = list(randomTiles(count, size, nFamilies))
+            checkSiblingDict(patterns, size, cutoff)
+            checkFilter(patterns, size, cutoff)
+
+
+## Locality Sensitive Hashing ##
+def graphPairs(indptr: np.array, indices: np.array) -> set[tuple[int]]:
+    rows = np.repeat(np.arange(indptr.size - 1), np.diff(indptr))
+    return {(i, j) for i, j in zip(rows.tolist(), indices.tolist()) if i < j}
+
+
+def compareFilters(patterns: np.array, size: int, cutoff: float = 0.4) -> dict:
+    exactGraph = siblingGraph(patterns, size, cutoff)
+    lshGraph = lshSiblingGraph(patterns, size, cutoff)
+    exactPairs, lshPairs = graphPairs(*exactGraph), graphPairs(*lshGraph)
+    exactKept, lshKept = selectPatterns(*exactGraph), selectPatterns(*lshGraph)
+
+    # a kept pattern is clean when no other kept pattern is an exact sibling of it
+    indptr, indices = exactGraph
+    keptMask = np.full(len(patterns), False)
+    keptMask[lshKept] = True
+    clean = [np.count_nonzero(keptMask[indices[indptr[i]:indptr[i+1]]]) == 1 for i in lshKept]
+    return {'exact pairs': len(exactPairs), 'lsh pairs': len(lshPairs),
+            'pair recall': len(exactPairs & lshPairs) / max(len(exactPairs), 1),
+            'pair precision': len(exactPairs & lshPairs) / max(len(lshPairs), 1),
+            'exact kept': exactKept.size, 'lsh kept': lshKept.size,
+            'kept precision': np.mean(clean) if clean else 1.0}
+
+
+def printReport(report: dict) -> None:
+    printRow(report.keys(), width=16)
+    printRow([f'{value:.3f}' if isinstance(value, float) else value for value in report.values()], width=16)
+
+
+def lshReport(path: str, shape: tuple[int], cutoff: float = 0.4, stride: tuple[int] = None) -> None:
+    patterns = np.concatenate(list(iterTileBits(path, shape, stride)))
+    print(f'{path} generated {len(patterns)} {shape[0]} X {shape[1]} tiles')
+    printReport(compareFilters(patterns, shape[0] * shape[1], cutoff))
+
+
+def benchLsh(count: int = 4000, sizes: list[int] = (100, 900, 2500),
+             cases: list[tuple[float]] = ((0.02, 0.1), (0.05, 0.2), (0.15, 0.4))) -> None:
+    # (in-family flip chance, cutoff), lsh only hashes when the cutoff is tight enough to pay off
+    for size in sizes:
+        for flipChance, cutoff in cases:
+            patterns = randomTiles(count, size, count // 10, flipChance)
+            exact = timeCall(filterSiblings, list(patterns), size, cutoff)
+            lsh = timeCall(filterSiblings, list(patterns), size, cutoff, 'lsh')
+            print(f'N = {size}, flip chance = {flipChance}, cutoff = {cutoff}, exact {exact:.3f}s, lsh {lsh:.3f}s')
+            printReport(compareFilters(patterns, size, cutoff))
+
+
+## Resampling ##
+def continuousScaleLoop(image: np.array, factor: float) -> np.array:
+    # the old per-pixel loop, with its edge sums kept per channel (they used to sum over axis=(0, 1)
+    # of a 2-D slice, adding the three channels together)
+    pxSize = 1/factor
+    h0, w0 = image.shape[:2]
+    h1, w1 = int(h0 * factor), int(w0 * factor)
+    new_array = np.zeros((h1, w1, 3))
+    for i in range(h1):
+        for j in range(w1):
+            y0, y1 = i * pxSize, (i+1) * pxSize
+            x0, x1 = j * pxSize, (j+1) * pxSize
+
+            t, b, l, r = -y0 % 1, y1 % 1, -x0 % 1, x1 % 1
+
+            y0, y1 = math.ceil(y0), math.floor(y1)
+            x0, x1 = math.ceil(x0), math.floor(x1)
+            h, w = y1 - y0, x1 - x0
+
+            weightedSum = np.array([0.0, 0.0, 0.0])
+            top, bottom, left, right, width, height = tuple(
+                map(lambda x: x > 0, [t, b, l, r, w, h]))
+
+            # Middle
+            if width and height:
+                weightedSum += np.sum(image[y0:y1, x0:x1, :],
+                                      axis=(0, 1))
+            # Edges
+            if width:
+                if top:
+                    weightedSum += np.sum(image[y0 - 1, x0:x1, :],
+                                          axis=0) * t
+                if bottom:
+                    weightedSum += np.sum(image[y1, x0:x1, :],
+                                          axis=0) * b
+            if height:
+                if left:
+                    weightedSum += np.sum(image[y0:y1, x0 - 1, :],
+                                          axis=0) * l
+                if right:
+                    weightedSum += np.sum(image[y0:y1, x1, :],
+                                          axis=0) * r
+            # Corners
+            if top:
+                if left:
+                    weightedSum += t * l * \
+                        image[y0 - 1, x0 - 1, :]
+                if right:
+                    weightedSum += t * r * \
+                        image[y0 - 1, x1, :]
+            if bottom:
+                if left:
+                    weightedSum += b * l * \
+                        image[y1, x0 - 1, :]
+                if right:
+                    weightedSum += b * r * image[y1, x1, :]
+
+            new_array[i, j, :] = np.round(weightedSum / (pxSize ** 2))
+
+    return new_array.astype(np.uint8)
+
+
+def benchScale(shape: tuple[int] = (240, 320), factors: list[float] = (0.2, 0.25, 0.333, 0.5, 0.7, 0.9),
+               bigShape: tuple[int] = (3000, 4000)) -> None:
+    printRow(['factor', 'loop (s)', 'blas (s)', 'speedup', 'max diff', f'{bigShape[0]}x{bigShape[1]} (s)'])
+    image = rng.integers(0, 256, size=shape + (3,), dtype=np.uint8)
+    big = rng.integers(0, 256, size=bigShape + (3,), dtype=np.uint8)
+    for factor in factors:
+        loop = timeCall(continuousScaleLoop, image, factor)
+        blas = timeCall(continuousScale, image, factor, repeats=3)
+        diff = np.abs(continuousScaleLoop(image, factor).astype(int) - continuousScale(image, factor)).max()
+        printRow([factor, f'{loop:.4f}', f'{blas:.4f}', f'{loop / blas:.0f}x', diff,
+                  f'{timeCall(continuousScale, big, factor):.3f}'])
+
+
+## Asynchronous Updates ##
+def iterateStepwise(network: DiscreteHopfield, n: int) -> None:
+    # the old engine, two generator calls per step
+    for _ in range(n):
+        idx = hopfield.rng.integers(network.size)
+        if hopfield.rng.random() > network.stayChance(idx):
+            network.energy += 2 * network.state[idx] * network.siteField(idx)
+            network.flip(idx)
+
+
+def benchIterate(sizes: list[int] = (400, 2500), nPatterns: int = 10, steps: int = 50000,
+                 temp: float = 0.3) -> None:
+    printRow(['size', 'stepwise (us)', 'random (us)', 'sweep (us)'], width=16)
+    for size in sizes:
+        network = DiscreteHopfield(size)
+        network.hebbTrain(rng.integers(2, size=(nPatterns, size)))
+        network.setTemp(temp)
+        times = []
+        for schedule in (None, 'random', 'sweep'):
+            network.setToPattern(0)
+            network.addNoise(0.2)
+            if schedule is None:
+                times.append(timeCall(iterateStepwise, network, steps))
+                continue
+            network.setSchedule(schedule)
+            times.append(timeCall(network.iterate, steps))
+            if abs(network.energy - network.totalEnergy()) > 1e-6 * size:
+                raise Exception('the tracked energy drifted from the recomputed energy')
+        printRow([size] + [f'{1e6 * t / steps:.2f}' for t in times], width=16)
+
+
+def benchKinetic(size: int = 2500, nPatterns: int = 10, steps: int = 200000, temps: list[float] = (0.05, 0.2, 0.5),
+                 noise: float = 0.05) -> None:
+    # near a memory at low temperature almost every proposal is rejected
+    network = DiscreteHopfield(size)
+    network.hebbTrain(rng.integers(2, size=(nPatterns, size)))
+    printRow(['temp', 'random (s)', 'kinetic (s)', 'speedup', 'flips'], width=14)
+    for temp in temps:
+        network.setTemp(temp)
+        times = []
+        for schedule in ('random', 'kinetic'):
+            network.setSchedule(schedule)
+            network.setToPattern(0)
+            network.addNoise(noise)
+            start = time.perf_counter()
+            network.iterate(steps)
+            times.append(time.perf_counter() - start)
+            flips = network.flips
+            if abs(network.energy - network.totalEnergy()) > 1e-6 * size:
+                raise Exception('the tracked energy drifted from the recomputed energy')
+        printRow([temp, f'{times[0]:.3f}', f'{times[1]:.3f}', f'{times[0] / times[1]:.1f}x', flips], width=14)
+
+
+## Pipelines ##
+def pipelineSerial(path0: str, path1: str, steps: list[tuple['function', dict]]) -> None:
+    # one step over the whole batch at a time, saving and reloading in between
+    saveImages(getImages(path0), path1)
+    for func, kwargs in steps:
+        for name, image in getImages(path1, asDict=True).items():
+            saveImage(func(image, **kwargs), name, path1)
+
+
+def benchPipeline(count: int = 48, shape: tuple[int] = (600, 800), workers: list[int] = (1, 2, 4)) -> None:
+    steps = [(toGreyscale, {}), (compress, {'pxSize': 2}), (toOneBit, {})]
+    with tempfile.TemporaryDirectory() as path0, tempfile.TemporaryDirectory() as path1:
+        saveImages([rng.integers(0, 256, size=shape + (3,), dtype=np.uint8) for _ in range(count)], path0)
+        printRow(['images', 'workers', 'time (s)', 'speedup'])
+        serial = timeCall(pipelineSerial, path0, path1, steps)
+        expected = getImages(path1, asDict=True)
+        printRow([count, 'serial', f'{serial:.3f}', '1x'])
+        for n in workers:
+            pooled = timeCall(processFolder, path0, path1, steps, n)
+            if any((expected[name] != image).any() for name, image in getImages(path1, asDict=True).items()):
+                raise Exception('pipeline output differs from the step by step run')
+            printRow([count, n, f'{pooled:.3f}', f'{serial / pooled:.1f}x'])
+
+
+## Image I/O ##
+def benchImageIO(count: int = 32, shape: tuple[int] = (768, 1024), workers: list[int] = (1, 2, 4, 8),
+                 levels: list[int] = (1, 6)) -> None:
+    images = [rng.integers(0, 256, size=shape + (3,), dtype=np.uint8) // 64 * 64 for _ in range(count)]
+    with tempfile.TemporaryDirectory() as path:
+        files = [os.path.join(path, f'{i}.png') for i in range(count)]
+        printRow(['level', 'workers', 'write (s)', 'read (s)'])
+        for level in levels:
+            write = timeCall(lambda: [writeImage(image, file, level) for image, file in zip(images, files)])
+            read = timeCall(lambda: [readImage(file) for file in files])
+            printRow([level, 'serial', f'{write:.3f}', f'{read:.3f}'])
+            for n in workers:
+                write = timeCall(saveImages, images, path, n, level)
+                read = timeCall(getImages, path, False, n)
+                if any((a != b).any() for a, b in zip(images, (readImage(file) for file in files))):
+                    raise Exception('images changed on the way through disk')
+                printRow([level, n, f'{write:.3f}', f'{read:.3f}'])
+
+
+## Colour Conversion ##
+def toOneBitFloat(image: np.array) -> np.array:
+    flat_array = np.round((np.mean(image, axis=2)))
+    cutoff = np.mean(flat_array)
+    bitArray = (flat_array >= cutoff).astype(np.uint8)
+    return np.stack((bitArray, bitArray, bitArray), axis=2) * 255
+
+
+def multContrastFloat(image: np.array, mult: float = 2) -> np.array:
+    avg = np.median(image)
+    normed = image.astype(int) - avg
+    return np.clip(normed * mult + avg, 0, 255).astype(np.uint8)
+
+
+def peakMemory(func: 'function', *args) -> int:
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def benchColor(shape: tuple[int] = (4000, 6000)) -> None:
+    image = rng.integers(0, 256, size=shape + (3,), dtype=np.uint8)
+    if (toOneBit(image) != toOneBitFloat(image)).any() or (multContrast(image) != multContrastFloat(image)).any():
+        raise Exception('integer colour conversion differs from the float version')
+    printRow(['function', 'time (s)', 'peak (MB)'], width=22)
+    for func in [toOneBitFloat, toGreyscale, toOneBit, toOneBitMedian, toGreyscaleInPlace, toOneBitInPlace,
+                 multContrastFloat, multContrast, multContrastInPlace]:
+        printRow([func.__name__, f'{timeCall(func, image.copy()):.3f}',
+                  peakMemory(func, image.copy()) // 2 ** 20], width=22)
+
+
+## Concurrency ##
+def stressIO(jobs: int = 6, workers: int = 4, count: int = 4, shape: tuple[int] = (120, 160)) -> None:
+    # several network builds and animations at once in one process, none of them may touch the cwd
+    start = os.getcwd()
+    with tempfile.TemporaryDirectory() as images, tempfile.TemporaryDirectory() as saves:
+        for i in range(count):
+            coarse = rng.integers(0, 256, size=(shape[0] // 10, shape[1] // 10, 3), dtype=np.uint8)
+            Image.fromarray(coarse).resize(shape[::-1]).save(os.path.join(images, f'{i}.png'))
+        names = [f'net{j}' for j in range(jobs)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda name: makeNetworkFromFolder(images, saves, 10, 10, 0.4, 1, name), names))
+            list(executor.map(lambda name: makeNetworkAnimation(saves, saves, name, 0, 0.1, 0.1, 200, 20, 5),
+                              names))
+        if os.getcwd() != start:
+            raise Exception(f'the working directory moved to {os.getcwd()}')
+        patterns = [loadNetwork(name, saves).patterns for name in names]
+        if any((p.shape != patterns[0].shape) or (p != patterns[0]).any() for p in patterns):
+            raise Exception('concurrent builds of the same folder made different networks')
+        missing = [name for name in names if not os.path.isfile(os.path.join(saves, f'{name}_0.gif'))]
+        if missing:
+            raise Exception(f'no animation was saved for {missing}')
+        print(f'{jobs} concurrent builds and animations agree, cwd untouched')
+
+
+if __name__ == '__main__':
+    benchHebbTrain()
+    benchCompact()
+    benchSiblings()
+    benchFilter()
+    benchLsh()
+    benchScale()
+    benchIterate()
+    benchKinetic()
+    benchPipeline()
+    benchImageIO()
+    benchColor()
+    stressIO()
@@ -10,17 +10,52 @@ def rgbToBits(rgb_array: np.array) -> np.array:
 
 
 def addNoise(bits: np.array, flipChance: float) -> np.array:
-    flips = rng.random(size=bits.size) < flipChance
-    for i in range(bits.size):
-        if flips[i]:
-            bits[i] += 1
-    return bits % 2
+    flips = rng.random(size=bits.shape) < flipChance
+    return (bits + flips) % 2
 
 
 def randomBits(size: int) -> np.array:
     return rng.integers(2, size=size)
 
 
+## Packing ##
+
+popCounts = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def packBits(bits: np.array) -> np.array:
+    return np.packbits(bits.astype(bool), axis=-1)
+
+
+def unpackBits(packed: np.array, size: int) -> np.array:
+    return np.unpackbits(packed, axis=-1, count=size).astype(np.int8)
+
+
+def asPacked(bits: np.array, size: int) -> np.array:
+    if bits.dtype == np.uint8 and bits.shape[-1] == -(-size // 8):
+        return bits
+    return packBits(bits)
+
+
+def complementBits(packed: np.array, size: int) -> np.array:
+    # flips every bit but leaves the zero padding of the last byte alone
+    complement = np.bitwise_not(packed)
+    complement[..., -1] &= (0xFF << (-size % 8)) & 0xFF
+    return complement
+
+
+def popcount(packed: np.array) -> np.array:
+    return popCounts[packed].sum(axis=-1, dtype=np.int64)
+
+
+def packedHamming(packed0: np.array, packed1: np.array) -> np.array:
+    return popcount(np.bitwise_xor(packed0, packed1))
+
+
+def packedOverlap(packed0: np.array, packed1: np.array, size: int) -> np.array:
+    return 1 - 2 * packedHamming(packed0, packed1) / size
+
+
 ## Compression ##
 
 def intToBits(num: int, intSize: int) -> np.array:
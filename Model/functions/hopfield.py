@@ -1,4 +1,5 @@
 import numpy as np
+from Model.functions.bitArrays import asPacked, unpackBits
 
 ## Ising Arrays ##
 
@@ -14,19 +15,106 @@ def bitsToIsing(bits: np.array) -> np.array:
 
 
 def addNoise(ising: np.array, flipChance: float) -> np.array:
-    ising = ising.copy()
-    flips = rng.random(size=ising.size) < flipChance
-    for i in range(ising.size):
-        if flips[i]:
-            ising[i] *= -1
-    return ising
+    flips = rng.random(size=ising.shape) < flipChance
+    return ising * (1 - 2 * flips.astype(ising.dtype))
 
 
 def randomIsing(size: int) -> np.array:
-    bits = rng.integers(2, size=size)
+    bits = rng.integers(2, size=size, dtype=np.int8)
     return bitsToIsing(bits)
 
 
+## Hebbian Training ##
+
+def countType(nPatterns: int) -> type:
+    if nPatterns <= np.iinfo(np.int8).max:
+        return np.int8
+    elif nPatterns <= np.iinfo(np.int16).max:
+        return np.int16
+    return np.int32
+
+
+def hebbWeights(isingPatterns: np.array, chunkSize: int = None, compact: bool = False) -> np.array:
+    # compact weights are the raw co-occurrence counts, the true weights are counts / size
+    nPatterns, size = isingPatterns.shape
+    if chunkSize is None:
+        chunkSize = max(1, 2**22 // size) if compact else size
+    isingPatterns = isingPatterns.astype(float)
+    weights = np.empty((size, size), dtype=countType(nPatterns) if compact else float)
+    for i in range(0, size, chunkSize):
+        if compact:
+            weights[i:i+chunkSize] = isingPatterns[:, i:i+chunkSize].T @ isingPatterns
+        else:
+            np.matmul(isingPatterns[:, i:i+chunkSize].T, isingPatterns,
+                      out=weights[i:i+chunkSize])
+    if not compact:
+        weights /= size
+    np.fill_diagonal(weights, 0)
+    return weights
+
+
+def countField(counts: np.array, state: np.array, chunkSize: int = None) -> np.array:
+    # integer sums stay exact in float64, so the product runs through BLAS a block at a time
+    size = counts.shape[0]
+    if chunkSize is None:
+        chunkSize = max(1, 2**22 // size)
+    state = state.astype(float)
+    field = np.empty(state.shape, dtype=np.int32)
+    for i in range(0, size, chunkSize):
+        field[..., i:i+chunkSize] = state @ counts[i:i+chunkSize].astype(float).T
+    return field
+
+
+def pairIndices(pairs: np.array, size: int) -> tuple[np.array]:
+    # pairs are numbered row by row over the upper triangle, i < j
+    rowStarts = np.concatenate(([0], np.cumsum(np.arange(size - 1, 0, -1))))
+    i = np.searchsorted(rowStarts, pairs, side='right') - 1
+    j = pairs - rowStarts[i] + i + 1
+    return i, j
+
+
+
+## Flip Rates ##
+
+class FenwickTree:
+    # prefix sums of the flip chances, for O(log n) point updates and sampling by cumulative rate
+    def __init__(self, values: np.array):
+        self.rebuild(values)
+
+    def rebuild(self, values: np.array) -> None:
+        self.values = np.array(values, dtype=float)
+        self.size = len(self.values)
+        prefix = np.concatenate(([0], np.cumsum(self.values)))
+        idx = np.arange(1, self.size + 1)
+        self.tree = [0.0] + (prefix[idx] - prefix[idx - (idx & -idx)]).tolist()
+        self.total = float(prefix[-1])
+        self.top = 1 << (self.size.bit_length() - 1) if self.size else 0
+
+    def add(self, i: int, delta: float) -> None:
+        self.total += delta
+        i += 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def update(self, values: np.array) -> None:
+        changed = np.flatnonzero(values != self.values)
+        # point updates only pay off while few rates moved, a rebuild is one vectorised pass
+        if len(changed) * self.size.bit_length() > self.size:
+            return self.rebuild(values)
+        for i, delta in zip(changed.tolist(), (values[changed] - self.values[changed]).tolist()):
+            self.add(i, delta)
+        self.values[changed] = values[changed]
+
+    def find(self, target: float) -> int:
+        # the first index whose running sum passes target
+        pos, step = 0, self.top
+        while step:
+            if pos + step <= self.size and self.tree[pos + step] <= target:
+                pos += step
+                target -= self.tree[pos]
+            step >>= 1
+        return min(pos, self.size - 1)
 
 
 class DiscreteHopfield:
@@ -35,16 +123,53 @@ class DiscreteHopfield:
         self.size = shape if isinstance(shape, int) else shape[0] * shape[1]
 
         # mutable
-        self.info = {'temp': 0, 'density': None,
+        self.info = {'temp': 0, 'density': None, 'backend': 'dense',
                      'shape': None if isinstance(shape, int) else shape}
 
         self.probFunc = lambda x: np.heaviside(x, 1)
         self.state = None
         self.patterns = None
         self.weights = None
+        self.field = None
+        self.scale = 1
+        self.energy = None
+        self.quiet = 0
+        self.flips = 0
+        self.setSchedule()
+
+    ## Local Field ##
+    def refreshField(self) -> None:
+        if self.weights is None or self.state is None:
+            self.field, self.energy = None, None
+            return
+        if np.issubdtype(self.weights.dtype, np.integer):
+            self.field = countField(self.weights, self.state)
+        elif self.state.ndim == 1:
+            self.field = self.weights @ self.state
+        else:
+            self.field = self.state @ self.weights
+        self.resetEnergy()
+
+    def siteField(self, idx: int) -> float:
+        return self.field[idx] * self.scale
+
+    def flip(self, idx: int) -> None:
+        # weights are symmetric, so row idx is the column that feeds every field
+        self.state[idx] *= -1
+        self.field += np.multiply(self.weights[idx], 2 * self.state[idx], dtype=self.field.dtype)
+
+    def batchField(self, idx: np.array) -> np.array:
+        return self.field[np.arange(idx.size), idx] * self.scale
+
+    def flipBatch(self, idx: np.array, accept: np.array) -> None:
+        rows = np.flatnonzero(accept)
+        idx = idx[rows]
+        self.state[rows, idx] *= -1
+        steps = (2 * self.state[rows, idx])[:, np.newaxis]
+        self.field[rows] += np.multiply(self.weights[idx], steps, dtype=self.field.dtype)
 
     def activation(self) -> np.array:
-        return self.weights @ self.state
+        return self.field * self.scale
 
     def onesProb(self) -> np.array:
         return self.probFunc(self.activation())
@@ -53,8 +178,38 @@ class DiscreteHopfield:
     def stayChances(self) -> np.array:
         return np.abs(self.onesProb() + np.clip(self.state, -1, 0))
 
+    def stayChance(self, idx: int) -> float:
+        return abs(self.probFunc(self.siteField(idx)) + min(self.state[idx], 0))
+
+    def batchStayChances(self, idx: np.array) -> np.array:
+        states = self.state[np.arange(idx.size), idx]
+        return np.abs(self.probFunc(self.batchField(idx)) + np.clip(states, -1, 0))
+
+    def converged(self, eps: float = 0) -> np.array:
+        return np.all(1 - self.stayChances <= eps, axis=-1)
+
     def stability(self) -> float:
-        return np.mean(self.stayChances)[0]
+        return np.mean(self.stayChances)
+
+    ## Energy and Fixed Points ##
+    def totalEnergy(self) -> np.array:
+        return -np.sum(self.state * self.activation(), axis=-1) / 2
+
+    def resetEnergy(self) -> None:
+        # quiet counts the single site updates since the last flip and flips the flips since this reset,
+        # per replica for a batch
+        self.energy = self.totalEnergy()
+        self.quiet = np.zeros(self.state.shape[0], dtype=np.int64) if self.state.ndim > 1 else 0
+        self.flips = np.zeros(self.state.shape[0], dtype=np.int64) if self.state.ndim > 1 else 0
+
+    def fixedPoint(self, eps: float = 0) -> np.array:
+        # no neuron would flip with more than eps chance, or under the sweep schedule the last whole sweep went
+        # by without a flip. Random picks with replacement leave about a third of the neurons out of size draws,
+        # so only a sweep counts. Blocks hold whole sweeps, the last one ended cursor % size steps ago.
+        # Synchronous steps report their own quiet sweeps from iterateSync
+        if self.schedule != 'sweep':
+            return self.converged(eps)
+        return (self.quiet >= self.cursor % self.size + self.size) | self.converged(eps)
 
     ## Temp ##
     def setTemp(self, temp: float) -> None:
@@ -68,53 +223,36 @@ class DiscreteHopfield:
     def setWeights(self, weights: np.array, density: int = None) -> None:
         self.info['density'] = density
         self.weights = weights
+        self.scale = 1 / self.size if np.issubdtype(weights.dtype, np.integer) else 1
+        self.refreshField()
 
     ## Patterns and Shape ##
     def setPatterns(self, patterns: np.array, shape: tuple[int] = None) -> None:
         self.info['shape'] = shape
-        self.patterns = patterns
+        self.patterns = asPacked(patterns, self.size)
 
-    def hebbTrainDense(self, patterns: np.array) -> None:
-        self.info['density'] = 1
-        self.weights = np.zeros((self.size, self.size))
-        self.patterns = patterns
-        isingPatterns = bitsToIsing(patterns)
-
-        for i in range(self.size):
-            j = i+1
-            while j < self.size:
-                w = (isingPatterns[:, i] @ isingPatterns[:, j]) / self.size
-                self.weights[i, j] = w
-                self.weights[j, i] = w
-                j += 1
-
-    def hebbTrain(self, patterns: np.array, density: float = 1) -> None:
+    def patternBits(self) -> np.array:
+        return unpackBits(self.patterns, self.size)
+
+    def hebbTrainDense(self, patterns: np.array, chunkSize: int = None, compact: bool = False) -> None:
+        self.patterns = asPacked(patterns, self.size)
+        self.setWeights(hebbWeights(bitsToIsing(self.patternBits()), chunkSize, compact), 1)
+
+    def hebbTrain(self, patterns: np.array, density: float = 1, chunkSize: int = None,
+                  compact: bool = False) -> None:
         nPairs = int((self.size) * (self.size - 1) / 2)
         nSkips = round((1 - density) * nPairs)
         if nSkips == 0:
-            self.hebbTrainDense(patterns)
+            self.hebbTrainDense(patterns, chunkSize, compact)
         else:
-            self.info['density'] = (nPairs - nSkips) / nSkips
-            self.weights = np.zeros((self.size, self.size))
-            self.patterns = patterns
-            isingPatterns = bitsToIsing(patterns)
-
-            pairs = np.arange(nPairs)
-            skipIndices = rng.choice(pairs, size=nSkips, replace=False)
-            bool_array = np.full(nPairs, True)
-            for skip in skipIndices:
-                bool_array[skip] = False
-
-            i, j = 0, 1
-            for instruction in bool_array:
-                if instruction:
-                    w = (isingPatterns[:, i] @ isingPatterns[:, j]) / self.size
-                    self.weights[i, j] = w
-                    self.weights[j, i] = w
-                j += 1
-                if j >= self.size:
-                    i += 1
-                    j = i+1
+            self.patterns = asPacked(patterns, self.size)
+            weights = hebbWeights(bitsToIsing(self.patternBits()), chunkSize, compact)
+
+            skipIndices = rng.choice(nPairs, size=nSkips, replace=False)
+            i, j = pairIndices(skipIndices, self.size)
+            weights[i, j] = 0
+            weights[j, i] = 0
+            self.setWeights(weights, (nPairs - nSkips) / nSkips)
 
     ## State ##
     def getState(self) -> np.array:
@@ -122,25 +260,184 @@ class DiscreteHopfield:
 
     def randomize(self) -> None:
         self.state = randomIsing(self.size)
+        self.refreshField()
 
     def setToPattern(self, idx: int) -> None:
-        self.state = bitsToIsing(self.patterns[idx])
+        self.state = bitsToIsing(unpackBits(self.patterns[idx], self.size))
+        self.refreshField()
+
+    def replicate(self, k: int) -> None:
+        self.state = np.tile(self.state, (k, 1))
+        self.refreshField()
 
     def addNoise(self, flipChance) -> None:
         self.state = addNoise(self.state, flipChance)
+        self.refreshField()
+
+    ## Update Schedule ##
+    def setSchedule(self, schedule: str = 'random', blockSize: int = 2**14) -> None:
+        # random picks neurons with replacement, sweep visits every neuron once per sweep in a fresh order,
+        # kinetic skips the rejected proposals and only draws the flips
+        if schedule not in ('random', 'sweep', 'kinetic'):
+            raise Exception(f'{schedule} is not a recognised update schedule')
+        self.schedule = schedule
+        self.blockSize = blockSize
+        self.blockIdx, self.cursor = None, 0
+
+    def refillBlock(self) -> None:
+        # neuron indices for many steps at once, one row per step. blockSize counts draws over all replicas,
+        # so a row of k replicas leaves blockSize // k rows. A sweep needs a whole permutation per replica
+        # whatever the block size, so the indices take the smallest integer that holds them
+        k = self.state.shape[:-1]
+        rows = max(1, self.blockSize // int(np.prod(k)))
+        dtype = np.int16 if self.size <= np.iinfo(np.int16).max else np.int32
+        if self.schedule == 'sweep':
+            order = np.broadcast_to(np.arange(self.size, dtype=dtype), k + (self.size,))
+            sweeps = [rng.permuted(order, axis=-1) for _ in range(max(1, rows // self.size))]
+            self.blockIdx = np.moveaxis(np.concatenate(sweeps, axis=-1) if len(sweeps) > 1 else sweeps[0], -1, 0)
+        else:
+            self.blockIdx = rng.integers(self.size, size=(rows,) + k, dtype=dtype)
+        self.cursor = 0
+
+    def takeBlock(self, n: int) -> tuple[np.array]:
+        # the cursor outlives the call, so short iterate calls carry on through the same block and sweep
+        if self.blockIdx is None or self.cursor == len(self.blockIdx) \
+                or self.blockIdx.shape[1:] != self.state.shape[:-1]:
+            self.refillBlock()
+        stop = min(self.cursor + n, len(self.blockIdx))
+        idx = self.blockIdx[self.cursor:stop]
+        self.cursor = stop
+        # the uniforms are only drawn for the steps handed out, single precision is plenty for an acceptance
+        return idx, rng.random(idx.shape, dtype=np.float32)
+
+    def flipChances(self) -> np.array:
+        return 1 - self.stayChances
+
+    def kineticFlip(self, rates: FenwickTree, limit: int) -> int:
+        # a proposal flips with chance total / size, so the wait is geometric and the neuron is picked by rate.
+        # Returns the standard iterations used, limit if no flip came by then. The wait is memoryless, so
+        # cutting it off at limit and drawing again on the next call changes nothing.
+        chance = min(1.0, rates.total / self.size)
+        wait = rng.geometric(chance) if chance > 0 else limit + 1
+        if wait > limit:
+            self.quiet += limit
+            return limit
+        idx = rates.find(rng.random() * rates.total)
+        self.energy += 2 * self.state[idx] * self.siteField(idx)
+        self.flip(idx)
+        self.quiet = 0
+        self.flips += 1
+        rates.update(self.flipChances())
+        return wait
+
+    def iterateKinetic(self, n: int = 1) -> None:
+        # the same n standard iterations without the rejected proposals
+        if self.state.ndim > 1:
+            raise Exception('the kinetic schedule runs a single state, not replicas')
+        rates = FenwickTree(self.flipChances())
+        while n > 0:
+            n -= self.kineticFlip(rates, n)
 
     def iterate(self, n: int = 1) -> None:
+        # every schedule counts its flips in self.flips
+        if self.schedule == 'kinetic':
+            self.iterateKinetic(n)
+            return
+        if self.state.ndim > 1:
+            self.iterateBatch(n)
+            return
+        while n > 0:
+            block, uniforms = self.takeBlock(n)
+            n -= len(block)
+            for idx, u in zip(block.tolist(), uniforms.tolist()):
+                if u > self.stayChance(idx):
+                    # the diagonal is zero, so flipping s_i changes the energy by 2 s_i h_i
+                    self.energy += 2 * self.state[idx] * self.siteField(idx)
+                    self.flip(idx)
+                    self.quiet = 0
+                    self.flips += 1
+                else:
+                    self.quiet += 1
+
+    def iterateBatch(self, n: int = 1) -> None:
+        rows = np.arange(self.state.shape[0])
+        while n > 0:
+            block, uniforms = self.takeBlock(n)
+            n -= len(block)
+            for idx, u in zip(block, uniforms):
+                accept = u > self.batchStayChances(idx)
+                steps = 2 * self.state[rows, idx] * self.batchField(idx)
+                self.energy += np.where(accept, steps, 0)
+                self.flipBatch(idx, accept)
+                self.quiet = np.where(accept, 0, self.quiet + 1)
+                self.flips += accept
+
+    def iterateSync(self) -> np.array:
+        # a synchronous step is a whole sweep, returns whether it went by without a flip, per replica for a batch
         probs = self.stayChances
-        for _ in range(n):
-            idx = rng.integers(self.size)
-            if rng.random() > probs[idx]:
-                self.state[idx] *= -1
-                probs = self.stayChances
-
-    def iterateSync(self) -> None:
-        probs = self.stayChances
-        samples = rng.random(self.size)
+        samples = rng.random(self.state.shape)
         stayVec = (samples <= probs).astype(int)
         self.state *= bitsToIsing(stayVec)
+        # the refresh starts the counts over, the flips carry on through it
+        flips = self.flips + np.count_nonzero(stayVec == 0, axis=-1)
+        self.refreshField()
+        self.flips = flips
+        return np.all(stayVec, axis=-1)
+
+
+class LowRankHopfield(DiscreteHopfield):
+    # Keeps the N x P ising patterns instead of the N x N weights. The field is
+    # (X (X^T s) - P s) / N, and the overlaps X^T s are updated on every flip.
+    def __init__(self, shape: int | tuple[int]):
+        super().__init__(shape)
+        self.info['backend'] = 'lowRank'
+        self.memories = None
+        self.overlaps = None
+
+    ## Local Field ##
+    def refreshField(self) -> None:
+        if self.memories is None or self.state is None:
+            self.overlaps, self.energy = None, None
+            return
+        self.overlaps = self.state @ self.memories
+        self.resetEnergy()
+
+    def siteField(self, idx: int) -> float:
+        nPatterns = float(self.memories.shape[1])
+        return (self.memories[idx] @ self.overlaps - nPatterns * self.state[idx]) / self.size
+
+    def flip(self, idx: int) -> None:
+        self.state[idx] *= -1
+        self.overlaps += 2 * self.state[idx] * self.memories[idx]
+
+    def batchField(self, idx: np.array) -> np.array:
+        nPatterns = float(self.memories.shape[1])
+        states = self.state[np.arange(idx.size), idx]
+        fields = np.einsum('kp,kp->k', self.memories[idx], self.overlaps)
+        return (fields - nPatterns * states) / self.size
+
+    def flipBatch(self, idx: np.array, accept: np.array) -> None:
+        rows = np.flatnonzero(accept)
+        idx = idx[rows]
+        self.state[rows, idx] *= -1
+        self.overlaps[rows] += (2 * self.state[rows, idx])[:, np.newaxis] * self.memories[idx]
+
+    def activation(self) -> np.array:
+        nPatterns = float(self.memories.shape[1])
+        return (self.overlaps @ self.memories.T - nPatterns * self.state) / self.size
 
-    
+    ## Weights and Density ##
+    def setWeights(self, weights: np.array, density: int = None) -> None:
+        raise Exception('a low rank network has no weight matrix, train it from its patterns')
+
+    def hebbTrainDense(self, patterns: np.array, chunkSize: int = None, compact: bool = False) -> None:
+        self.info['density'] = 1
+        self.patterns = asPacked(patterns, self.size)
+        self.memories = np.ascontiguousarray(bitsToIsing(self.patternBits()).T, dtype=float)
+        self.refreshField()
+
+    def hebbTrain(self, patterns: np.array, density: float = 1, chunkSize: int = None,
+                  compact: bool = False) -> None:
+        if density != 1:
+            raise Exception('a low rank network can only be trained with a density of 1')
+        self.hebbTrainDense(patterns, chunkSize, compact)
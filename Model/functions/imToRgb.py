@@ -1,6 +1,8 @@
 from PIL import Image
-from typing import NewType, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import NewType, Tuple, Iterator, Callable
 from nptyping import NDArray, UInt8, Shape
+from Model.functions.rgbArrays import tiles, compress
 import numpy as np
 import os
 
@@ -36,7 +38,7 @@ def hasImageExt(name: fileName) -> bool:
 
 
 def getImageNames(path: str = '', keepExt: bool = True) -> list[fileName]:
-    names = filter(lambda file: hasImageExt(file), os.listdir(path))
+    names = filter(lambda file: hasImageExt(file), os.listdir(path or '.'))
     if keepExt:
         return list(names)
     else:
@@ -45,51 +47,100 @@ def getImageNames(path: str = '', keepExt: bool = True) -> list[fileName]:
 
 ## Single Image ##
 
+def draftScale(pxSize: int) -> int:
+    # the largest jpeg DCT scale (1/2, 1/4, 1/8) that divides the compression
+    scale = 1
+    while scale < 8 and pxSize % (scale * 2) == 0:
+        scale *= 2
+    return scale
+
+
+def readImage(file: str, pxSize: int = 1) -> rgb:
+    with Image.open(file) as image:
+        w0, h0 = image.size
+        done = 1
+        scale = draftScale(pxSize)
+        if scale > 1 and min(w0, h0) >= scale:
+            # only jpegs honour draft, they decode already shrunk by a power of two
+            drafted = image.draft('RGB', (w0 // scale, h0 // scale))
+            if drafted is not None:
+                done = round(w0 / drafted[1][2])
+        rgb_array = np.asarray(image.convert(mode='RGB')).astype(np.uint8)
+    if pxSize == 1:
+        return rgb(rgb_array)
+    return rgb(compress(rgb_array, pxSize // done)[:h0 // pxSize, :w0 // pxSize])
+
+
 def getImage(name: fileName, path: str = '') -> rgb:
-    names = getImageNames(path)
-    start = os.getcwd()
-    os.chdir(f'{start}/{path}')
-    for file in names:
-        if file.startswith(name) and any([file.endswith(ext) for ext in imageExts]):
-            image = Image.open(name).convert(mode='RGB')
-            os.chdir(start)
-            return rgb(np.asarray(image).astype(np.uint8))
-    else:
-        raise Exception(f'there is no image file named {name} in {path}')
+    for file in getImageNames(path):
+        if file.startswith(name):
+            return readImage(os.path.join(path, file))
+    raise Exception(f'there is no image file named {name} in {path}')
 
 
 ## Multiple Images ##
 
-def getImages(path: str, asDict: bool = False) -> list[rgb] | dict[fileName, rgb]:
-    names = getImageNames(path)
-    images = []
-    start = os.getcwd()
-    os.chdir(f'{start}/{path}')
-    for name in names:
-        image = Image.open(name).convert(mode='RGB')
-        images.append(rgb(np.asarray(image).astype(np.uint8)))
-    os.chdir(start)
+# pillow lets go of the GIL while decoding and encoding, so a few threads work side by side
+ioWorkers = min(32, (os.cpu_count() or 1) + 4)
 
-    return dict(zip(names, images)) if asDict else images
 
+def readImages(files: list[str], workers: int = None) -> list[rgb]:
+    with ThreadPoolExecutor(max_workers=workers or ioWorkers) as executor:
+        return list(executor.map(readImage, files))
 
-def tiles(rgb_array: rgb, shape: Tuple[int, int]) -> list[rgb]:
-    h0, w0 = rgb_array.shape[:2]
-    h1, w1 = shape
-    y, x = 0, 0
-    tile_arrays = []
-    while y + h1 <= h0:
-        while x + w1 <= w0:
-            tile_arrays.append(rgb(rgb_array[y: y+h1, x: x+w1, :]))
-            x += w1
-        x = 0
-        y += h1
-    return tile_arrays
 
+def getImages(path: str, asDict: bool = False, workers: int = None) -> list[rgb] | dict[fileName, rgb]:
+    names = getImageNames(path)
+    images = readImages([os.path.join(os.path.abspath(path), name) for name in names], workers)
+
+    return dict(zip(names, images)) if asDict else images
 
-def getImageTiles(path: str, shape: Tuple[int, int]) -> list[rgb]:
-    images = getImages(path)
+
+def getImageTiles(path: str, shape: Tuple[int, int], stride: Tuple[int, int] = None) -> list[rgb]:
+    images = LazyImages(path)
     cropped = []
     for image in images:
-        cropped.extend(tiles(image, shape))
+        cropped.extend(tiles(image, shape, stride))
     return cropped
+
+
+## Streaming ##
+
+def iterImages(path: str) -> Iterator[rgb]:
+    for name in getImageNames(path):
+        yield readImage(os.path.join(path, name))
+
+
+## Lazy Collections ##
+
+class LazyImages:
+    # the images of a folder, decoded one at a time when iterated or indexed
+    def __init__(self, path: str, pxSize: int | Callable[[int, int], int] = 1) -> None:
+        self.path = path
+        self.names = getImageNames(path)
+        self.pxSize = pxSize
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, i: int) -> rgb:
+        file = os.path.join(self.path, self.names[i])
+        return readImage(file, self.pxSizeOf(file))
+
+    def __iter__(self) -> Iterator[rgb]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def pxSizeOf(self, file: str) -> int:
+        if not callable(self.pxSize):
+            return self.pxSize
+        # opening only reads the header, the size is known before decoding
+        with Image.open(file) as image:
+            return self.pxSize(*image.size)
+
+    def compressed(self, pxSize: int | Callable[[int, int], int]) -> 'LazyImages':
+        # the same folder, decoded straight to the compressed size
+        return LazyImages(self.path, pxSize)
+
+    def asDict(self) -> dict[fileName, rgb]:
+        return dict(zip(self.names, self))
@@ -2,6 +2,7 @@ import numpy as np
 import math
 from imToRgb import getImageTiles, getImages, removeExt
 from RgbToBits import rgbToBits
+from bitArrays import packBits
 from patternFiltering import filterSiblings
 from RgbToIm import saveImage
 import rgbArrays as rgb
@@ -61,7 +62,7 @@ def cropAll(path0='imported', path1='processed'):
 ## Analysis ##
 def findNumPatterns(path: str, shape: tuple[int] = (100, 100), cutoff: float = 0.4) -> None:
     rgb_arrays = getImageTiles(path, shape)
-    tiles = list(map(rgbToBits, rgb_arrays))
+    tiles = [packBits(rgbToBits(rgb_array)) for rgb_array in rgb_arrays]
     print(f'{path} generated {len(tiles)} {shape[0]} X {shape[1]} tiles')
-    patterns = filterSiblings(tiles, cutoff)
+    patterns = filterSiblings(tiles, shape[0] * shape[1], cutoff)
     print(f'{len(patterns)} of them can be used as patterns with a hebb cutoff of {cutoff}')
@@ -42,11 +42,8 @@ def getImageNames(path: str = '', keepExt: bool = True) -> list[fileName]:
 def saveImage(rgb_array: rgb, name: fileName, path: str = '') -> None:
     if not hasImageExt(name):
         name = name + '.png'
-    start = os.getcwd()
-    os.chdir(f'{start}/{path}')
     image = Image.fromarray(rgb_array.astype(np.uint8), mode='RGB')
-    image.save(name)
-    os.chdir(start)
+    image.save(os.path.join(path, name))
 
 def display_contents(line_limit: int, start: int = 0) -> None:
     print('Files and Folders in ', os.getcwd())
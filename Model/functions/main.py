@@ -1,13 +1,19 @@
+import copy
 import pickle
 import os
+import threading
+from collections import OrderedDict
 import numpy as np
-from Model.functions.hopfield import DiscreteHopfield
-from Model.functions.imToRgb import getImageTiles, getImages, getImageNames
-from Model.functions.RgbToBits import rgbToBits
-from Model.functions.patternFiltering import filterSiblings
+from Model.functions.hopfield import DiscreteHopfield, LowRankHopfield
+from Model.functions.bitArrays import packBits, unpackBits
+from Model.functions.imToRgb import getImages, getImageNames, iterImages, LazyImages
+from Model.functions.RgbToBits import tileBits
+from Model.functions.patternFiltering import filterSiblings, OnlineSiblingFilter, dedupPatterns
+from Model.functions.arrayCache import cachedTileBits
 from Model.functions.bitsToRgb import heatMap, bitsToRgb
-from Model.functions.RgbToIm import saveImage, saveGif
-from Model.functions.rgbArrays import compress, multContrast, toOneBitMedian
+from Model.functions.RgbToIm import saveImage, writeImages, saveGif
+from Model.functions.networkFile import networkExt, writeNetworkFile, readNetworkFile, isNetworkFile
+from Model.functions.rgbArrays import multContrast, toOneBitMedian
 
 
 ## Image Prep ##
@@ -17,22 +23,22 @@ def getImageDict(path: str) -> dict[str, np.array]:
     return dict(zip(names, rgb_arrays))
 
 
-def compressImages(path0='_images/imported', path1='_images/_edit0'):
-    names = getImageNames(path0)
-    rgb_arrays = getImages(path0)
-    compRates = []
-    for im in rgb_arrays:
-        if im.size >= 1280 * 720:
-            compRates.append(5)
-        elif im.size >= 640 * 480:
-            compRates.append(3)
-        elif im.size >= 200 * 200:
-            compRates.append(2)
-        else:
-            compRates.append(1)
+def compRate(w: int, h: int) -> int:
+    size = w * h * 3
+    if size >= 1280 * 720:
+        return 5
+    elif size >= 640 * 480:
+        return 3
+    elif size >= 200 * 200:
+        return 2
+    else:
+        return 1
+
 
-    compressed = map(compress, rgb_arrays, compRates)
-    for im, name in zip(compressed, names):
+def compressImages(path0='_images/imported', path1='_images/_edit0'):
+    # the rate is picked from each header and the images decode straight to the compressed size
+    images = LazyImages(path0, compRate)
+    for im, name in zip(images, images.names):
         saveImage(im, name + 'contrast', path1)
 
 
@@ -58,60 +64,184 @@ def convertToOneBitImages(path0, path1='_images/_oneBits'):
 
 
 ## Patterns ##
-def generatePatterns(path: str, shape: tuple[int], cutoff: float = 0.4) -> np.array:
-    rgb_arrays = getImageTiles(path, shape)
-    bit_arrays = list(map(rgbToBits, rgb_arrays))
-    return np.stack(filterSiblings(bit_arrays, cutoff))
+def iterTileBits(path: str, shape: tuple[int], stride: tuple[int] = None, cache: bool = False) -> np.array:
+    if cache:
+        # unchanged files come back memory mapped from the array cache without decoding
+        for name in getImageNames(path):
+            packed = cachedTileBits(os.path.join(path, name), shape, stride)
+            if len(packed) > 0:
+                yield packed
+        return
+    # one image is decoded at a time and only its packed tile bits are kept
+    for image in iterImages(path):
+        bits = tileBits(image, shape, stride)
+        if len(bits) > 0:
+            yield packBits(bits)
+
+
+def generatePatterns(path: str, shape: tuple[int], cutoff: float = 0.4, mode: str = 'exact',
+                     stride: tuple[int] = None, cache: bool = True) -> np.array:
+    size = shape[0] * shape[1]
+    if mode == 'online':
+        siblingFilter = OnlineSiblingFilter(size, cutoff)
+        for bit_arrays in iterTileBits(path, shape, stride, cache):
+            siblingFilter.add(bit_arrays)
+        return siblingFilter.getPatterns()
+    bit_arrays = [bits for batch in iterTileBits(path, shape, stride, cache) for bits in batch]
+    unique = dedupPatterns(bit_arrays, size)
+    print(f'{len(bit_arrays)} tiles, dropped {len(bit_arrays) - len(unique)} exact duplicates')
+    bit_arrays = [bit_arrays[i] for i in unique]
+    return np.stack(filterSiblings(bit_arrays, size, cutoff, mode))
 
 
 ## Network ##
-def loadNetwork(name: str, path: str = '') -> DiscreteHopfield:
-    start = os.getcwd()
-    os.chdir(f'{start}/{path}/{name}')
-    weights = np.load('weights.npy')
-    patterns = np.load('patterns.npy')
-    with open('info.pickle', 'rb') as file:
-        info = pickle.load(file)
-    temp = info['temp']
-    density = info['density']
-    shape = info['shape']
-    os.chdir(start)
+lowRankRatio = 0.1
 
-    network = DiscreteHopfield(shape)
-    network.setTemp(temp)
-    network.setWeights(weights, density)
+
+def buildNetwork(info: dict, patterns: np.array, weights: np.array = None) -> DiscreteHopfield:
+    shape = info['shape']
+    if info.get('backend', 'dense') == 'lowRank':
+        network = LowRankHopfield(shape)
+        network.hebbTrain(patterns)
+    else:
+        network = DiscreteHopfield(shape)
+        network.setWeights(weights, info['density'])
+    network.setTemp(info['temp'])
     network.setPatterns(patterns, shape)
     return network
 
 
-def makeNetwork(patterns: np.array, density: float = 1, shape: tuple[int] = None) -> DiscreteHopfield:
+def loadNetworkDir(name: str, path: str = '') -> DiscreteHopfield:
+    # the old layout, a folder of .npy files and a pickled info dict
+    folder = os.path.join(path, name)
+    patterns = np.load(os.path.join(folder, 'patterns.npy'))
+    with open(os.path.join(folder, 'info.pickle'), 'rb') as file:
+        info = pickle.load(file)
+    backend = info.get('backend', 'dense')
+    weights = np.load(os.path.join(folder, 'weights.npy')) if backend == 'dense' else None
+    return buildNetwork(info, patterns, weights)
+
+
+def loadNetwork(name: str, path: str = '') -> DiscreteHopfield:
+    file = os.path.join(path, name + networkExt)
+    if not isNetworkFile(file):
+        return loadNetworkDir(name, path)
+    # memory mapped, the weights are paged in as the network reads them
+    info, _, patterns, weights = readNetworkFile(file)
+    return buildNetwork(info, patterns, weights)
+
+
+def chooseBackend(nPatterns: int, size: int, density: float = 1) -> str:
+    if density == 1 and nPatterns <= lowRankRatio * size:
+        return 'lowRank'
+    return 'dense'
+
+
+def makeNetwork(patterns: np.array, density: float = 1, shape: tuple[int] = None,
+                backend: str = 'auto', compact: bool = False) -> DiscreteHopfield:
     if shape is None:
         shape = patterns.shape[1]
-    network = DiscreteHopfield(shape)
-    network.hebbTrain(patterns, density)
+    if backend == 'auto':
+        size = shape if isinstance(shape, int) else shape[0] * shape[1]
+        backend = chooseBackend(len(patterns), size, density)
+    match backend:
+        case 'dense':
+            network = DiscreteHopfield(shape)
+        case 'lowRank':
+            network = LowRankHopfield(shape)
+        case _:
+            raise Exception(f'{backend} is not a recognised network backend')
+    network.hebbTrain(patterns, density, compact=compact)
     return network
 
 
 def saveNetwork(network: DiscreteHopfield, name: str, path: str = '') -> None:
-    start = os.getcwd()
-    os.chdir(f'{start}/{path}')
-    os.mkdir(name)
-    os.chdir(name)
-    np.save('weights.npy', network.weights)
-    np.save('patterns.npy', network.patterns)
-    with open('info.pickle', 'wb') as file:
-        pickle.dump(network.info, file, protocol=pickle.HIGHEST_PROTOCOL)
-    if network.info['shape'] is not None:
-        os.mkdir('patterns')
-        for i, pattern in enumerate(network.patterns):
-            rgb_array = bitsToRgb(pattern, network.info['shape'])
-            saveImage(rgb_array, f'{i}.png', path='patterns')
-    os.chdir(start)
-
-
-def makeNetworkFromFolder(import_folder, save_folder, width, height, cutoff, density, name):
+    info = dict(network.info, shape=None if network.info['shape'] is None else list(network.info['shape']))
+    file = os.path.join(path, name + networkExt)
+    writeNetworkFile(file, info, network.size, network.patterns, network.weights)
+    forgetNetwork(file)
+
+
+def convertNetwork(name: str, path: str = '') -> None:
+    # rewrites a network folder as a single network file next to it, the folder is left alone
+    saveNetwork(loadNetworkDir(name, path), name, path)
+
+
+## Network Registry ##
+# loaded networks by resolved source path, least recently used first
+registryBytes = 2 * 1024 ** 3
+registry = OrderedDict()
+registryLock = threading.Lock()
+
+
+def networkSource(name: str, path: str = '') -> str:
+    file = os.path.join(path, name + networkExt)
+    return os.path.realpath(file if isNetworkFile(file) else os.path.join(path, name))
+
+
+def sourceMtime(source: str) -> int:
+    if os.path.isdir(source):
+        return max(entry.stat().st_mtime_ns for entry in os.scandir(source))
+    return os.stat(source).st_mtime_ns
+
+
+def networkBytes(network: DiscreteHopfield) -> int:
+    return sum(value.nbytes for value in vars(network).values() if isinstance(value, np.ndarray))
+
+
+def shareNetwork(network: DiscreteHopfield) -> DiscreteHopfield:
+    # the weights and patterns are only ever read, each caller gets its own state and info
+    clone = copy.copy(network)
+    clone.info = dict(network.info)
+    return clone
+
+
+def evictNetworks(limit: int = None) -> None:
+    limit = registryBytes if limit is None else limit
+    with registryLock:
+        total = sum(entry[2] for entry in registry.values())
+        while registry and total > limit:
+            total -= registry.popitem(last=False)[1][2]
+
+
+def forgetNetwork(file: str) -> None:
+    with registryLock:
+        registry.pop(os.path.realpath(file), None)
+
+
+def getNetwork(name: str, path: str = '') -> DiscreteHopfield:
+    source = networkSource(name, path)
+    mtime = sourceMtime(source)
+    with registryLock:
+        entry = registry.get(source)
+        if entry is not None and entry[0] == mtime:
+            registry.move_to_end(source)
+            return shareNetwork(entry[1])
+    network = loadNetwork(name, path)
+    nBytes = networkBytes(network)
+    if nBytes <= registryBytes:
+        with registryLock:
+            registry[source] = (mtime, network, nBytes)
+            registry.move_to_end(source)
+        evictNetworks()
+    return shareNetwork(network)
+
+
+## Pattern Previews ##
+def patternPreview(network: DiscreteHopfield, idx: int) -> np.array:
+    return bitsToRgb(unpackBits(network.patterns[idx], network.size), network.info['shape'])
+
+
+def savePatternPreviews(network: DiscreteHopfield, path: str, indices: list[int] = None) -> None:
+    if indices is None:
+        indices = range(len(network.patterns))
+    writeImages((patternPreview(network, i) for i in indices), [os.path.join(path, f'{i}.png') for i in indices])
+
+
+def makeNetworkFromFolder(import_folder, save_folder, width, height, cutoff, density, name,
+                          filter_mode='exact'):
     print('Creating network. This may take a while.')
-    patterns = generatePatterns(import_folder, (height, width), cutoff)
+    patterns = generatePatterns(import_folder, (height, width), cutoff, filter_mode)
     print(f'generated {len(patterns)} patterns')
     network = makeNetwork(patterns, density, (height, width))
     print('trained network')
@@ -127,24 +257,56 @@ def initializeState(network: DiscreteHopfield, idx: int, temp: float, noise: flo
     network.addNoise(noise)
 
 
-def runNetwork(network: DiscreteHopfield, n: int, sampleRate: int) -> tuple[list[np.array]]:
+def runNetwork(network: DiscreteHopfield, n: int, sampleRate: int, eps: float = 0,
+               earlyStop: bool = True) -> tuple[list[np.array], list[np.array], int, list[float]]:
+    # stops at the first sample that is a fixed point, the step is None if it never got there
     states = [network.getState()]
     probs = [network.onesProb()]
-    for _ in range(n // sampleRate):
+    energies = [network.energy]
+    if earlyStop and network.fixedPoint(eps):
+        return states, probs, 0, energies
+    for i in range(n // sampleRate):
         network.iterate(n=sampleRate)
         states.append(network.getState())
         probs.append(network.onesProb())
-    return states, probs
+        energies.append(network.energy)
+        if earlyStop and network.fixedPoint(eps):
+            return states, probs, (i + 1) * sampleRate, energies
+    return states, probs, None, energies
 
 
-def runNetworkSync(network: DiscreteHopfield, n: int) -> tuple[list[np.array]]:
+def runNetworkSync(network: DiscreteHopfield, n: int, eps: float = 0,
+                   earlyStop: bool = True) -> tuple[list[np.array], list[np.array], int, list[float]]:
     states = [network.getState()]
     probs = [network.onesProb()]
-    for _ in range(n):
-        network.iterateSync()
+    energies = [network.energy]
+    if earlyStop and network.converged(eps):
+        return states, probs, 0, energies
+    for i in range(n):
+        # the async sweep rule doesn't apply, a step with no flip is a quiet sweep on its own
+        quiet = network.iterateSync()
         states.append(network.getState())
         probs.append(network.onesProb())
-    return states, probs
+        energies.append(network.energy)
+        if earlyStop and (quiet | network.converged(eps)):
+            return states, probs, i + 1, energies
+    return states, probs, None, energies
+
+
+def initializeReplicas(network: DiscreteHopfield, idx: int, temp: float, noise: float, k: int):
+    network.setTemp(temp)
+    network.setToPattern(idx)
+    network.replicate(k)
+    network.addNoise(noise)
+
+
+def runReplicas(network: DiscreteHopfield, n: int, sync: bool = False) -> tuple[np.array]:
+    if sync:
+        for _ in range(n):
+            network.iterateSync()
+    else:
+        network.iterate(n)
+    return network.getState(), network.converged()
 
 
 ## Rendering ##
@@ -154,14 +316,19 @@ def render(states: list[np.array], probs: list[np.array], shape: tuple[int]) ->
 
 
 def makeNetworkAnimation(import_folder, save_folder, network_name, pattern_number,
-                             tempurature, noise, number_of_iterations, sample_rate, fps):
-        network = loadNetwork(network_name, import_folder)
+                             tempurature, noise, number_of_iterations, sample_rate, fps, preview=False):
+        network = getNetwork(network_name, import_folder)
         network.setTemp(tempurature)
         network.setToPattern(pattern_number)
         network.addNoise(noise)
-        states, probs = runNetwork(network, number_of_iterations, sample_rate)
-        print(f'pattern {pattern_number} run')
+        states, probs, convergedAt, _ = runNetwork(network, number_of_iterations, sample_rate)
+        if convergedAt is None:
+            print(f'pattern {pattern_number} run')
+        else:
+            print(f'pattern {pattern_number} run, reached a fixed point after {convergedAt} iterations')
 
         frames = render(states, probs, network.info['shape'])
         saveGif(frames, network_name + f'_{pattern_number}', path=save_folder, fps=fps)
+        if preview:
+            saveImage(patternPreview(network, pattern_number), network_name + f'_{pattern_number}', save_folder)
         print(f'gif {pattern_number} rendered and saved')
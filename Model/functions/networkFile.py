@@ -0,0 +1,86 @@
+import json
+import os
+import numpy as np
+
+
+## Format ##
+# magic, little endian uint32 version and header length, the JSON header padded to the alignment,
+# then every array raw and C ordered at its header offset counted from the end of the header
+networkExt = '.hop'
+networkMagic = b'HOPFIELD'
+networkVersion = 1
+alignment = 64
+
+
+def padTo(n: int, align: int = alignment) -> int:
+    return -(-n // align) * align
+
+
+## Weights ##
+def compactWeights(weights: np.array, size: int) -> np.array:
+    # float hebbian weights are counts / size, the counts fit the smallest integer that holds them
+    if np.issubdtype(weights.dtype, np.integer):
+        return weights
+    scaled = weights * size
+    counts = np.rint(scaled)
+    if np.abs(counts - scaled).max(initial=0) > 1e-6:
+        return weights
+    bound = np.abs(counts).max(initial=0)
+    for dtype in (np.int8, np.int16, np.int32):
+        if bound <= np.iinfo(dtype).max:
+            return counts.astype(dtype)
+    return weights
+
+
+## Writing ##
+def writeNetworkFile(file: str, info: dict, size: int, patterns: np.array, weights: np.array = None) -> None:
+    arrays = {'patterns': np.ascontiguousarray(patterns)}
+    if weights is not None:
+        arrays['weights'] = np.ascontiguousarray(compactWeights(weights, size))
+    entries, offset = {}, 0
+    for key, array in arrays.items():
+        entries[key] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = padTo(offset + array.nbytes)
+    header = json.dumps({'info': info, 'size': size, 'arrays': entries}).encode()
+    start = padTo(len(networkMagic) + 8 + len(header))
+    header = header.ljust(start - len(networkMagic) - 8)
+    # 'xb' refuses to overwrite, like the old os.mkdir of the network folder
+    with open(file, 'xb') as out:
+        out.write(networkMagic)
+        out.write(np.array([networkVersion, len(header)], dtype='<u4').tobytes())
+        out.write(header)
+        for key, array in arrays.items():
+            out.seek(start + entries[key]['offset'])
+            out.write(array.tobytes())
+
+
+## Reading ##
+def readHeader(file: str) -> tuple[dict, int]:
+    with open(file, 'rb') as source:
+        if source.read(len(networkMagic)) != networkMagic:
+            raise Exception(f'{file} is not a network file')
+        version, length = np.frombuffer(source.read(8), dtype='<u4')
+        if version > networkVersion:
+            raise Exception(f'{file} is version {version}, only versions up to {networkVersion} can be read')
+        return json.loads(source.read(length)), len(networkMagic) + 8 + int(length)
+
+
+def readNetworkFile(file: str, mmapMode: str = 'r') -> tuple[dict, int, np.array, np.array]:
+    # the arrays are memory mapped, pages are only read when the network touches them
+    header, start = readHeader(file)
+    arrays = {}
+    for key, entry in header['arrays'].items():
+        shape = tuple(entry['shape'])
+        if np.prod(shape) == 0:
+            arrays[key] = np.zeros(shape, dtype=entry['dtype'])
+        else:
+            arrays[key] = np.memmap(file, dtype=entry['dtype'], mode=mmapMode, offset=start + entry['offset'],
+                                    shape=shape)
+    info = header['info']
+    if info.get('shape') is not None:
+        info['shape'] = tuple(info['shape'])
+    return info, header['size'], arrays['patterns'], arrays.get('weights')
+
+
+def isNetworkFile(file: str) -> bool:
+    return os.path.isfile(file) and file.endswith(networkExt)
@@ -1,46 +1,245 @@
+import math
 import numpy as np
+from Model.functions.bitArrays import packedHamming, unpackBits, complementBits
 
+# patterns are packed bit rows (see bitArrays.packBits), size is the unpacked bit count
 
-def hammingDist(bits0: np.array, bits1: np.array) -> float:
-    return np.sum(np.abs(bits0 - bits1)) / bits0.size
+rng = np.random.default_rng()
 
 
-def findSiblings(patterns: list[np.array], idx: int, cutoff: float = 0.4) -> set[int]:
-    siblings = set()
-    for i, pattern in enumerate(patterns):
-        dist = hammingDist(pattern, patterns[idx])
-        if dist <= cutoff or 1 - cutoff <= dist:
-            siblings.add(i)
-    return siblings
+def hammingDist(bits0: np.array, bits1: np.array, size: int) -> float:
+    return packedHamming(bits0, bits1) / size
 
 
-def findSiblingDict(patterns: list[np.array], idx: int, cutoff: float = 0.4) -> dict[int, set[int]]:
+def findSiblings(patterns: list[np.array], idx: int, size: int, cutoff: float = 0.4) -> set[int]:
+    dists = packedHamming(np.stack(patterns), patterns[idx]) / size
+    return set(np.flatnonzero((dists <= cutoff) | (1 - cutoff <= dists)).tolist())
+
+
+def dedupPatterns(patterns: list[np.array], size: int) -> np.array:
+    # indices of the first copy of each tile, a tile and its complement count as copies
+    packed = np.asarray(patterns)
+    if len(packed) == 0:
+        return np.zeros(0, dtype=int)
+    flipped = (packed[:, 0] >> 7).astype(bool)
+    canonical = packed.copy()
+    canonical[flipped] = complementBits(packed[flipped], size)
+    firsts = dict()
+    for i, row in enumerate(canonical):
+        firsts.setdefault(row.tobytes(), i)
+    return np.fromiter(firsts.values(), dtype=int, count=len(firsts))
+
+
+def siblingBounds(size: int, cutoff: float = 0.4) -> tuple[int]:
+    # dot products of +-1 rows are size - 2 * hamming, so the distance test on every
+    # possible hamming count reduces to two bounds on the dot product
+    dists = np.arange(size + 1) / size
+    near = np.flatnonzero(dists <= cutoff)
+    far = np.flatnonzero(1 - cutoff <= dists)
+    upper = size - 2 * near[-1] if near.size else size + 1
+    lower = size - 2 * far[0] if far.size else -size - 1
+    return upper, lower
+
+
+def siblingGraph(patterns: list[np.array], size: int, cutoff: float = 0.4,
+                 blockSize: int = 2048) -> tuple[np.array]:
+    # sibling lists of every pattern in CSR form: the siblings of i are indices[indptr[i]:indptr[i+1]]
+    packed = np.asarray(patterns)
+    nPatterns = len(packed)
+    upper, lower = siblingBounds(size, cutoff)
+    rows, cols = [], []
+    for i in range(0, nPatterns, blockSize):
+        block0 = 2 * unpackBits(packed[i:i+blockSize], size).astype(np.float32) - 1
+        for j in range(i, nPatterns, blockSize):
+            block1 = 2 * unpackBits(packed[j:j+blockSize], size).astype(np.float32) - 1
+            dots = block0 @ block1.T
+            r, c = np.nonzero((dots >= upper) | (dots <= lower))
+            r, c = r + i, c + j
+            if j > i:
+                r, c = np.concatenate((r, c)), np.concatenate((c, r))
+            rows.append(r)
+            cols.append(c)
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=int)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=int)
+    return toGraph(rows, cols, nPatterns)
+
+
+def toGraph(rows: np.array, cols: np.array, nPatterns: int) -> tuple[np.array]:
+    order = np.argsort(rows, kind='stable')
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=nPatterns))))
+    return indptr, cols[order]
+
+
+## Locality Sensitive Hashing ##
+def sampleKeys(packed: np.array, positions: np.array) -> np.array:
+    sampled = (packed[:, positions // 8] >> (7 - positions % 8)) & 1
+    return sampled.astype(np.int64) @ (1 << np.arange(positions.size, dtype=np.int64))
+
+
+def bucketPairs(keys0: np.array, keys1: np.array) -> tuple[np.array]:
+    # every (i, j) with keys0[i] == keys1[j]
+    order = np.argsort(keys1, kind='stable')
+    sortedKeys = keys1[order]
+    lo = np.searchsorted(sortedKeys, keys0, side='left')
+    counts = np.searchsorted(sortedKeys, keys0, side='right') - lo
+    i = np.repeat(np.arange(keys0.size), counts)
+    offsets = np.arange(i.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    return i, order[np.repeat(lo, counts) + offsets]
+
+
+def lshParams(nPatterns: int, size: int, cutoff: float = 0.4, recall: float = 0.95) -> tuple[int]:
+    # A sibling pair agrees on a sampled bit with chance at least 1 - cutoff, so it shares a
+    # bucket in one of nTables tables of nBits bits with chance 1 - (1 - (1 - cutoff)^nBits)^nTables.
+    # The cheapest nBits that reaches recall is kept, counting the unrelated pairs (half their bits
+    # agree) that land together in each table and in its complement table.
+    best = (math.inf, None, None)
+    for nBits in range(1, min(size, 62) + 1):
+        hit = (1 - cutoff) ** nBits
+        if hit <= 0:
+            break
+        nTables = math.ceil(math.log(1 - recall) / math.log1p(-hit)) if hit < 1 else 1
+        cost = nTables * (nPatterns + nPatterns ** 2 * 0.5 ** nBits)
+        best = min(best, (cost, nBits, nTables))
+    return best
+
+
+def lshSiblingGraph(patterns: list[np.array], size: int, cutoff: float = 0.4, nTables: int = None,
+                    nBits: int = None, recall: float = 0.95, blockSize: int = 2**20) -> tuple[np.array]:
+    # Bit sampling hashes: only tiles that share a bucket are compared exactly. A tile's
+    # complement is hashed as well so anti-correlated siblings meet in a bucket too.
+    packed = np.asarray(patterns)
+    nPatterns = len(packed)
+    if nBits is None or nTables is None:
+        cost, bits, tables = lshParams(nPatterns, size, cutoff, recall)
+        # far from near duplicates no table layout beats comparing every pair, which the exact graph does with BLAS
+        if cost >= nPatterns * (nPatterns - 1) / 2:
+            return siblingGraph(patterns, size, cutoff)
+        nBits = bits if nBits is None else nBits
+        nTables = tables if nTables is None else nTables
+    nBits = min(nBits, size, 62)
+    mask = (1 << nBits) - 1
+
+    candidates = []
+    for _ in range(nTables):
+        keys = sampleKeys(packed, rng.choice(size, size=nBits, replace=False))
+        for i, j in (bucketPairs(keys, keys), bucketPairs(keys, keys ^ mask)):
+            candidates.append(i[i < j] * nPatterns + j[i < j])
+    candidates = np.unique(np.concatenate(candidates)) if candidates else np.zeros(0, dtype=np.int64)
+
+    upper, lower = siblingBounds(size, cutoff)
+    rows, cols = [np.arange(nPatterns)], [np.arange(nPatterns)]
+    for k in range(0, candidates.size, blockSize):
+        i, j = np.divmod(candidates[k:k+blockSize], nPatterns)
+        dots = size - 2 * packedHamming(packed[i], packed[j])
+        close = (dots >= upper) | (dots <= lower)
+        rows.extend((i[close], j[close]))
+        cols.extend((j[close], i[close]))
+    return toGraph(np.concatenate(rows), np.concatenate(cols), nPatterns)
+
+
+def findSiblingDict(patterns: list[np.array], size: int, cutoff: float = 0.4) -> dict[int, set[int]]:
+    indptr, indices = siblingGraph(patterns, size, cutoff)
     siblingDict = dict()
     for i in range(len(patterns)):
-        siblingDict[i] = findSiblings(patterns, i, cutoff)
+        siblingDict[i] = set(indices[indptr[i]:indptr[i+1]].tolist())
     return siblingDict
 
 
-def filterSiblings(patterns: list[np.array], cutoff: float = 0.4) -> list[int]:
-    siblingDict = findSiblingDict(patterns, cutoff)
-    for i in range(len(patterns)):
-        siblingDict[i] = findSiblings(patterns, i, cutoff)
-    siblingList = [{'set': siblingDict[i], 'idx': i}
-                   for i in range(len(patterns)) if len(siblingDict[i]) > 1]
-    onlyChildren = [{'set': siblingDict[i], 'idx': i}
-                    for i in range(len(patterns)) if len(siblingDict[i]) == 1]
+def selectPatterns(indptr: np.array, indices: np.array, blockSize: int = 256) -> np.array:
+    # Greedily drops the pattern with the most remaining siblings until none are left.
+    # Ties go to the pattern whose count fell most recently, then to the one that led
+    # the tie before, which is the order repeated stable sorts of the sibling list give.
+    # rank encodes that order: every pattern that loses a sibling is ranked ahead of all others.
+    nPatterns = indptr.size - 1
+    degree = np.diff(indptr)
+    alive = np.full(nPatterns, True)
+    rank = np.arange(nPatterns)
+    front = 0
+
+    # priority packs (degree, -rank) into one integer, -1 marks patterns that can't be dropped
+    scale = indices.size + nPatterns + 1
+    nBlocks = max(1, -(-nPatterns // blockSize))
+    priority = np.full(nBlocks * blockSize, -1, dtype=np.int64)
+    priority[:nPatterns] = np.where(degree > 1, degree * scale + nPatterns - 1 - rank, -1)
+    blocks = priority.reshape(nBlocks, blockSize)
+    blockMax = blocks.max(axis=1)
 
     while True:
-        if len(siblingList) == 0:
-            break
-        siblingList.sort(key=lambda dct: len(dct['set']), reverse=True)
-        siblings, idx = siblingList[0].values()
-        if len(siblings) > 1:
-            siblingList.pop(0)
-            siblings.remove(idx)
-            for i in siblings:
-                siblingDict[i].remove(idx)
-        else:
+        block = int(np.argmax(blockMax))
+        if blockMax[block] < 0:
             break
-    siblingList.extend(onlyChildren)
-    return [patterns[dct['idx']] for dct in siblingList]
+        idx = block * blockSize + int(np.argmax(blocks[block]))
+        alive[idx] = False
+        priority[idx] = -1
+
+        siblings = indices[indptr[idx]:indptr[idx+1]]
+        siblings = siblings[alive[siblings]]
+        siblings = siblings[np.argsort(rank[siblings], kind='stable')]
+        degree[siblings] -= 1
+        rank[siblings] = np.arange(front - siblings.size, front)
+        front -= siblings.size
+        priority[siblings] = np.where(degree[siblings] > 1,
+                                      degree[siblings] * scale + nPatterns - 1 - rank[siblings], -1)
+
+        touched = np.unique(np.append(siblings // blockSize, block))
+        blockMax[touched] = blocks[touched].max(axis=1)
+
+    survivors = np.flatnonzero(alive & (np.diff(indptr) > 1))
+    survivors = survivors[np.argsort(rank[survivors], kind='stable')]
+    onlyChildren = np.flatnonzero(np.diff(indptr) == 1)
+    return np.concatenate((survivors, onlyChildren))
+
+
+class OnlineSiblingFilter:
+    # Accepts tiles as they arrive and rejects any tile with a sibling among those already
+    # accepted, so memory grows with the accepted set rather than with the input.
+    def __init__(self, size: int, cutoff: float = 0.4) -> None:
+        self.size = size
+        self.upper, self.lower = siblingBounds(size, cutoff)
+        self.ising = np.zeros((16, size), dtype=np.float32)
+        self.patterns = []
+
+    def isSibling(self, dots: np.array) -> np.array:
+        return (dots >= self.upper) | (dots <= self.lower)
+
+    def add(self, packed: np.array, chunkSize: int = 256) -> np.array:
+        # chunks see the tiles accepted from the chunks before them, so the result is the same
+        # as one tile at a time while the work arrays stay chunkSize x (accepted + chunkSize)
+        accept = np.zeros(len(packed), dtype=bool)
+        for i in range(0, len(packed), chunkSize):
+            accept[i:i + chunkSize] = self.addChunk(packed[i:i + chunkSize])
+        return accept
+
+    def addChunk(self, packed: np.array) -> np.array:
+        count = len(self.patterns)
+        ising = 2 * unpackBits(packed, self.size).astype(np.float32) - 1
+        accept = ~self.isSibling(ising @ self.ising[:count].T).any(axis=1)
+
+        # tiles in the chunk are checked against the earlier ones that got in
+        new = np.flatnonzero(accept)
+        inBatch = self.isSibling(ising[new] @ ising[new].T)
+        for k, i in enumerate(new):
+            if inBatch[k, :k][accept[new[:k]]].any():
+                accept[i] = False
+
+        added = np.flatnonzero(accept)
+        while count + added.size > len(self.ising):
+            self.ising = np.concatenate((self.ising, np.zeros_like(self.ising)))
+        self.ising[count:count + added.size] = ising[added]
+        self.patterns.extend(packed[added])
+        return accept
+
+    def getPatterns(self) -> np.array:
+        return np.stack(self.patterns) if self.patterns else np.zeros((0, -(-self.size // 8)), dtype=np.uint8)
+
+
+def filterSiblings(patterns: list[np.array], size: int, cutoff: float = 0.4,
+                   mode: str = 'exact') -> list[np.array]:
+    match mode:
+        case 'exact':
+            indptr, indices = siblingGraph(patterns, size, cutoff)
+        case 'lsh':
+            indptr, indices = lshSiblingGraph(patterns, size, cutoff)
+        case _:
+            raise Exception(f'{mode} is not a recognised filter mode')
+    return [patterns[i] for i in selectPatterns(indptr, indices)]
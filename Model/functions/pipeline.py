@@ -0,0 +1,72 @@
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import math
+import os
+import numpy as np
+from Model.functions.imToRgb import getImageNames, readImage, rgb
+from Model.functions.rgbArrays import compress
+import Model.functions.rgbArrays as rgbArrays
+
+
+## Steps ##
+def runSteps(image: rgb, steps: list[tuple['function', dict]]) -> rgb:
+    for func, kwargs in steps:
+        image = func(image, **kwargs)
+    return image
+
+
+def stepsOf(processes: list) -> list[tuple['function', dict]]:
+    # module level functions and plain kwargs pickle, the processes' argument checkers don't
+    return [(process.func, process.arg_dict) for process in processes]
+
+
+## Workers ##
+def processFile(task: tuple) -> str:
+    src, dst, steps = task
+    if steps and steps[0][0] is compress:
+        # a leading compress happens while decoding, jpegs come out of draft already shrunk
+        rgb_array = readImage(src, steps[0][1]['pxSize'])
+        steps = steps[1:]
+    else:
+        rgb_array = readImage(src)
+    Image.fromarray(runSteps(rgb_array, steps).astype(np.uint8), mode='RGB').save(dst)
+    return dst
+
+
+def processImage(task: tuple) -> rgb:
+    rgb_array, steps = task
+    return runSteps(rgb_array, steps)
+
+
+def chunkSizeFor(n: int, workers: int) -> int:
+    # a few chunks per worker keeps the pool balanced without paying a round trip per image
+    return max(1, math.ceil(n / (workers * 4)))
+
+
+def seedWorker() -> None:
+    # forked workers start with a copy of the parent's generator, each draws fresh entropy instead
+    rgbArrays.rng = np.random.default_rng()
+
+
+def poolMap(func: 'function', tasks: list, workers: int = None, chunkSize: int = None) -> list:
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        return list(map(func, tasks))
+    chunkSize = chunkSize or chunkSizeFor(len(tasks), workers)
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=seedWorker) as executor:
+        return list(executor.map(func, tasks, chunksize=chunkSize))
+
+
+## Batches ##
+def processBatch(images: list[rgb], steps: list[tuple['function', dict]], workers: int = None,
+                 chunkSize: int = None) -> list[rgb]:
+    return poolMap(processImage, [(image, steps) for image in images], workers, chunkSize)
+
+
+def processFolder(path0: str, path1: str, steps: list[tuple['function', dict]], workers: int = None,
+                  chunkSize: int = None) -> list[str]:
+    # each worker reads, transforms and writes its own images so only file names cross processes
+    path0, path1 = os.path.abspath(path0), os.path.abspath(path1)
+    tasks = [(os.path.join(path0, name), os.path.join(path1, f'{i}.png'), steps)
+             for i, name in enumerate(getImageNames(path0))]
+    return poolMap(processFile, tasks, workers, chunkSize)
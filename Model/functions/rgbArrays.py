@@ -1,5 +1,6 @@
-from typing import NewType, Tuple
+from typing import NewType, Tuple, Iterator
 from nptyping import NDArray, UInt8, Shape
+from numpy.lib.stride_tricks import sliding_window_view
 import math
 import numpy as np
 
@@ -65,117 +66,80 @@ def marginCrop(image: rgb, margins: Tuple[int, int]) -> rgb:
     return image[t:h-b, l:w-r, :]
 
 
-def tiles(image: rgb, shape: Tuple[int, int]) -> list[rgb]:
-    h0, w0 = image.shape[:2]
-    h1, w1 = shape
-    y, x = 0, 0
-    tile_arrays = []
-    while y + h1 <= h0:
-        while x + w1 <= w0:
-            tile_arrays.append(rgb(image[y: y+h1, x: x+w1, :]))
-            x += w1
-        x = 0
-        y += h1
-    return tile_arrays
+def tileView(image: np.array, shape: Tuple[int, int], stride: Tuple[int, int] = None,
+             offset: Tuple[int, int] = (0, 0)) -> np.array:
+    # zero-copy view of every window, indexed (row, col, y, x, ...)
+    stride = shape if stride is None else stride
+    y, x = offset
+    windows = sliding_window_view(image[y:, x:], shape, axis=(0, 1))
+    if image.ndim == 3:
+        windows = np.moveaxis(windows, 2, -1)
+    return windows[::stride[0], ::stride[1]]
+
+
+def tiles(image: rgb, shape: Tuple[int, int], stride: Tuple[int, int] = None,
+          offset: Tuple[int, int] = (0, 0)) -> list[rgb]:
+    if image.shape[0] < offset[0] + shape[0] or image.shape[1] < offset[1] + shape[1]:
+        return []
+    return [rgb(tile) for row in tileView(image, shape, stride, offset) for tile in row]
 
 
 ## Compression ##
 
+def blockSums(image: np.array, pxSize: int) -> np.array:
+    h1, w1 = image.shape[0] // pxSize, image.shape[1] // pxSize
+    blocks = image.reshape((h1, pxSize, w1, pxSize) + image.shape[2:])
+    return blocks.sum(axis=(1, 3), dtype=np.int64)
+
+
+def roundDiv(sums: np.array, n: int) -> np.array:
+    # integer division rounded half to even, the same as np.round(sums / n)
+    quot, rem = np.divmod(sums, n)
+    return quot + ((2 * rem > n) | ((2 * rem == n) & (quot % 2 == 1)))
+
+
 def compress(image: rgb, pxSize: int, refPt: Tuple[int, int] = (0, 0)) -> rgb:
     h0, w0 = image.shape[:2]
-    h1, w1 = h0 // pxSize, w0 // pxSize
+    h1, w1 = (h0 - refPt[0]) // pxSize, (w0 - refPt[1]) // pxSize
     image = shapePtCrop(image, (h1*pxSize, w1*pxSize), refPt=refPt)
-    new_array = np.zeros((h1, w1, 3))
-    for i in range(h1):
-        for j in range(w1):
-            y0, y1 = i * pxSize, (i+1) * pxSize
-            x0, x1 = j * pxSize, (j+1) * pxSize
-            new_array[i, j, :] = np.round(
-                np.mean(image[y0:y1, x0:x1, :], axis=(0, 1)))
-    return new_array.astype(np.uint8)
+    return roundDiv(blockSums(image, pxSize), pxSize ** 2).astype(np.uint8)
 
 
 def oneBitCompress(image: rgb, pxSize: int, refPt: Tuple[int, int] = (0, 0)) -> rgb:
     h0, w0 = image.shape[:2]
-    h1, w1 = h0 // pxSize, w0 // pxSize
-    image = shapeCrop(image, (h1*pxSize, w1*pxSize), refPt=refPt)
+    h1, w1 = (h0 - refPt[0]) // pxSize, (w0 - refPt[1]) // pxSize
+    image = shapePtCrop(image, (h1*pxSize, w1*pxSize), refPt=refPt)
+    counts = blockSums(image[:, :, 0] != 0, pxSize)
+    reds = np.where(2 * counts > pxSize ** 2, 255, 0).astype(np.uint8)
+    return np.stack((reds, reds, reds), axis=2)
 
-    new_array = np.zeros((h1, w1, 3))
-    for i in range(h1):
-        for j in range(w1):
-            y0, y1 = i * pxSize, (i+1) * pxSize
-            x0, x1 = j * pxSize, (j+1) * pxSize
-            if len(np.flatnonzero(image[y0:y1, x0:x1, 0])) > (y1-y0) * (x1-x0) / 2:
-                new_array[i, j, :] = 255
-            else:
-                new_array[i, j, :] = 0
-    return new_array.astype(np.uint8)
 
+def areaWeights(n0: int, pxSize: float, start: int, stop: int) -> tuple[int, np.array]:
+    # rows are output pixels start..stop, columns the source pixels they overlap from first on,
+    # each entry the overlapping length divided by pxSize
+    edges = np.arange(start, stop + 1) * pxSize
+    first = min(int(edges[0]), n0)
+    last = min(math.ceil(edges[-1]), n0)
+    src = np.arange(first, last)
+    overlap = np.minimum(edges[1:, np.newaxis], src + 1) - np.maximum(edges[:-1, np.newaxis], src)
+    return first, np.clip(overlap, 0, None) / pxSize
 
-def continuousScale(image: rgb, factor: float) -> rgb:
-    nPrints = 0
 
+def continuousScale(image: rgb, factor: float, chunkSize: int = 256) -> rgb:
     pxSize = 1/factor
     h0, w0 = image.shape[:2]
     h1, w1 = int(h0 * factor), int(w0 * factor)
     new_array = np.zeros((h1, w1, 3))
-    for i in range(h1):
-        for j in range(w1):
-            y0, y1 = i * pxSize, (i+1) * pxSize
-            x0, x1 = j * pxSize, (j+1) * pxSize
-
-            t, b, l, r = -y0 % 1, y1 % 1, -x0 % 1, x1 % 1
-
-            y0, y1 = math.ceil(y0), math.floor(y1)
-            x0, x1 = math.ceil(x0), math.floor(x1)
-            h, w = y1 - y0, x1 - x0
-
-            weightedSum = np.array([0.0, 0.0, 0.0])
-            top, bottom, left, right, width, height = tuple(
-                map(lambda x: x > 0, [t, b, l, r, w, h]))
-
-            # Middle
-            if width and height:
-                weightedSum += np.sum(image[y0:y1, x0:x1, :],
-                                      axis=(0, 1))
-            # Edges
-            if width:
-                if top:
-                    weightedSum += np.sum(image[y0 - 1, x0:x1, :],
-                                          axis=(0, 1)) * t
-                if bottom:
-                    weightedSum += np.sum(image[y1, x0:x1, :],
-                                          axis=(0, 1)) * b
-            if height:
-                if left:
-                    weightedSum += np.sum(image[y0:y1, x0 - 1, :],
-                                          axis=(0, 1)) * l
-                if right:
-                    weightedSum += np.sum(image[y0:y1, x1, :],
-                                          axis=(0, 1)) * r
-            # Corners
-            if top:
-                if left:
-                    weightedSum += t * l * \
-                        image[y0 - 1, x0 - 1, :]
-                if right:
-                    weightedSum += t * r * \
-                        image[y0 - 1, x1, :]
-            if bottom:
-                if left:
-                    weightedSum += b * l * \
-                        image[y1, x0 - 1, :]
-                if right:
-                    weightedSum += b * r * image[y1, x1, :]
-
-            new_array[i, j, :] = np.round(weightedSum / (pxSize ** 2))
-            if nPrints < 26:
-                nPrints += 1
-                print(i, j, t, b, l, r, w, h)
-                print(weightedSum)
-                print(np.round(weightedSum / (pxSize ** 2)))
-
-    return new_array.astype(np.uint8)
+    for i in range(0, h1, chunkSize):
+        y0, rows = areaWeights(h0, pxSize, i, min(i + chunkSize, h1))
+        for j in range(0, w1, chunkSize):
+            x0, cols = areaWeights(w0, pxSize, j, min(j + chunkSize, w1))
+            block = image[y0:y0 + rows.shape[1], x0:x0 + cols.shape[1], :]
+            # channel planes are made contiguous so the products go through BLAS
+            planes = np.ascontiguousarray(np.moveaxis(block, 2, 0), dtype=float)
+            for c in range(3):
+                new_array[i:i + chunkSize, j:j + chunkSize, c] = rows @ planes[c] @ cols.T
+    return np.clip(np.round(new_array), 0, 255).astype(np.uint8)
 
 
 def scaleToTarget(image: rgb, target: int, mode: str = 'smallest dimension') -> rgb:
@@ -199,43 +163,101 @@ def scaleUp(image: rgb, scale: int) -> rgb:
     return np.kron(image, np.ones((scale, scale, 1))).astype(np.uint8)
 
 
+## Banded Integer Ops ##
+
+def rowBands(image: np.array, chunkSize: int = 2 ** 20) -> Iterator[slice]:
+    rows = max(1, chunkSize // max(1, image[0].size))
+    for i in range(0, image.shape[0], rows):
+        yield slice(i, i + rows)
+
+
+def valueCounts(image: np.array) -> np.array:
+    # bincount widens to intp, so it only sees a band at a time
+    counts = np.zeros(256, dtype=np.int64)
+    for band in rowBands(image):
+        counts += np.bincount(image[band].ravel(), minlength=256)
+    return counts
+
+
+def medianValue(image: np.array) -> float:
+    # np.median of uint8 values, read off the cumulative histogram instead of a sorted copy
+    cumulative = np.cumsum(valueCounts(image))
+    n = cumulative[-1]
+    lower = np.searchsorted(cumulative, (n - 1) // 2, side='right')
+    upper = np.searchsorted(cumulative, n // 2, side='right')
+    return (lower + upper) / 2
+
+
+def applyTable(image: np.array, table: np.array, out: np.array = None) -> np.array:
+    if out is None:
+        out = np.empty_like(image, dtype=table.dtype)
+    for band in rowBands(image):
+        out[band] = table[image[band]]
+    return out
+
+
 ## Color Conversion ##
 
-def toGreyscale(image: rgb) -> rgb:
-    flat_array = np.round((np.mean(image, axis=2)))
-    return np.stack((flat_array, flat_array, flat_array), axis=2)
+def greyValues(image: rgb) -> np.array:
+    # the rounded channel mean of three values never lands on .5, so it is (sum + 1) // 3
+    grey = np.empty(image.shape[:2], dtype=np.uint8)
+    for band in rowBands(image):
+        sums = np.add(image[band, :, 0], image[band, :, 1], dtype=np.uint16)
+        sums += image[band, :, 2]
+        sums += 1
+        sums //= 3
+        grey[band] = sums
+    return grey
 
 
-def toOneBitMedian(image: rgb) -> rgb:
-    flat_array = np.round((np.mean(image, axis=2)))
-    cutoff = np.median(flat_array)
-    bitArray = (flat_array >= cutoff).astype(np.uint8)
-    return np.stack((bitArray, bitArray, bitArray), axis=2) * 255
+def greyToRgb(grey: np.array, out: rgb = None) -> rgb:
+    if out is None:
+        out = np.empty(grey.shape + (3,), dtype=np.uint8)
+    out[...] = grey[:, :, np.newaxis]
+    return out
 
 
-def toOneBit(image: rgb) -> rgb:
-    flat_array = np.round((np.mean(image, axis=2)))
-    cutoff = np.mean(flat_array)
-    bitArray = (flat_array >= cutoff).astype(np.uint8)
-    return np.stack((bitArray, bitArray, bitArray), axis=2) * 255
+def toGreyscale(image: rgb, out: rgb = None) -> rgb:
+    return greyToRgb(greyValues(image), out)
+
+
+def thresholdGrey(grey: np.array, cutoff: float) -> np.array:
+    # overwrites grey with 255 where it reaches the cutoff and 0 elsewhere
+    for band in rowBands(grey):
+        grey[band] = np.greater_equal(grey[band], cutoff) * np.uint8(255)
+    return grey
+
+
+def toOneBitMedian(image: rgb, out: rgb = None) -> rgb:
+    grey = greyValues(image)
+    return greyToRgb(thresholdGrey(grey, medianValue(grey)), out)
+
+
+def toOneBit(image: rgb, out: rgb = None) -> rgb:
+    grey = greyValues(image)
+    # grey >= mean is grey >= the mean rounded up, since grey is an integer
+    cutoff = -(-grey.sum(dtype=np.int64) // grey.size)
+    return greyToRgb(thresholdGrey(grey, cutoff), out)
+
+
+def toGreyscaleInPlace(image: rgb) -> rgb:
+    return toGreyscale(image, out=image)
+
+
+def toOneBitMedianInPlace(image: rgb) -> rgb:
+    return toOneBitMedian(image, out=image)
+
+
+def toOneBitInPlace(image: rgb) -> rgb:
+    return toOneBit(image, out=image)
 
 
 ## Tiling ##
 
 def tilesByRow(image: rgb, shape: Tuple[int, int] = (100, 100)) -> list[rgb]:
-    h0, w0 = image.shape[:2]
-    h1, w1 = shape
-    y, x = 0, 0
-    rows = []
-    while y + h1 <= h0:
-        row = []
-        while x + w1 <= w0:
-            row.append(image[y: y+h1, x: x+w1, :])
-            x += w1
-        x = 0
-        y += h1
-        rows.append(row)
-    return rows
+    if image.shape[0] < shape[0] or image.shape[1] < shape[1]:
+        return []
+    return [list(row) for row in tileView(image, shape)]
 
 
 ## Effects ##
@@ -256,18 +278,34 @@ def addBorder(image: rgb, width: int, color: color = np.array([0, 0, 0])) -> rgb
     return padded + border
 
 
-def addRgbNoise(image: rgb, sigma: int = 60) -> rgb:
-    noise = np.rint(sigma * rng.standard_normal(image.shape))
-    return np.clip(image + noise, 0, 255).astype(np.uint8)
+def addRgbNoise(image: rgb, sigma: int = 60, out: rgb = None, chunkSize: int = 2 ** 20) -> rgb:
+    if out is None:
+        out = np.empty_like(image, dtype=np.uint8)
+    # the float noise only ever exists for a band of about chunkSize values
+    for band in rowBands(image, chunkSize):
+        noise = np.rint(sigma * rng.standard_normal(image[band].shape))
+        noise += image[band]
+        np.clip(noise, 0, 255, out=noise)
+        out[band] = noise
+    return out
+
+
+def contrastTable(avg: float, mult: float) -> np.array:
+    # the old per pixel formula evaluated once for every possible value
+    return np.clip((np.arange(256) - avg) * mult + avg, 0, 255).astype(np.uint8)
+
+
+def multContrast(image: rgb, mult: float = 2, out: rgb = None) -> rgb:
+    return applyTable(image, contrastTable(medianValue(image), mult), out)
+
+
+def multContrastMean(image: rgb, mult: float = 2, out: rgb = None) -> rgb:
+    return applyTable(image, contrastTable(np.mean(image), mult), out)
 
 
-def multContrast(image: rgb, mult: float = 2) -> rgb:
-    avg = np.median(image)
-    normed = image.astype(int) - avg
-    return np.clip(normed * mult + avg, 0, 255).astype(np.uint8)
+def addRgbNoiseInPlace(image: rgb, sigma: int = 60) -> rgb:
+    return addRgbNoise(image, sigma, out=image)
 
 
-def multContrastMean(image: rgb, mult: float = 2) -> rgb:
-    avg = np.mean(image)
-    normed = image.astype(int) - avg
-    return np.clip(normed * mult + avg, 0, 255).astype(np.uint8)
+def multContrastInPlace(image: rgb, mult: float = 2) -> rgb:
+    return multContrast(image, mult, out=image)
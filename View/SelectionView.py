@@ -31,8 +31,10 @@ class AppSelectionView(SelectionView):
         presenter.on_app_choice(input(self.prompt))
 
 class ProcessSelectionView(SelectionView):
-    def __init__(self, options) -> None:
+    def __init__(self, options, queued = None) -> None:
         header = 'Select image operation'
+        if queued:
+            header += '\nQueued: ' + ' -> '.join(queued)
         super().__init__(header, options)
     
     def display(self, presenter):
@@ -54,6 +54,11 @@ class Presenter:
         if not self.model.is_valid_option(value):
             self.view.set_error('Please enter a valid selection')
             self.view.display(self)
+        elif self.model.get_option(value) == 'Run queued steps' and len(self.model.pipeline.processes) == 0:
+            self.view.set_error('Please queue an image operation first')
+        elif self.model.get_option(value) == 'Run queued steps':
+            self.model.run_pipeline()
+            self.view = MessageView('The image operations have finished running.')
         else:
             process = self.model.get_option(value)
             self.model.start_process(process)
@@ -61,9 +66,8 @@ class Presenter:
             if len(arg_names) > 0:
                 self.view = ParameterInputView(arg_names)
             else:
-                self.model.run_process()
-                self.model.save_batch()
-                self.view = MessageView('The image operation has finished running.')
+                self.model.add_step()
+                self.view = ProcessSelectionView(self.model.options, self.model.pipeline.names)
         self.view.display(self)
     
     def on_network_process_choice(self, value):
@@ -85,8 +89,13 @@ class Presenter:
         if value == 'undo':
             field = self.view.undo()
             self.model.reset_field(field)
+        elif value == 'back' and isinstance(self.model, ProcessImagesApp):
+            self.view = ProcessSelectionView(self.model.options, self.model.pipeline.names)
         elif value == 'back':
-            self.view = ProcessSelectionView(self.model.options)
+            self.view = NetworkView(self.model.options)
+        elif self.view.is_complete() and isinstance(self.model, ProcessImagesApp):
+            self.model.add_step()
+            self.view = ProcessSelectionView(self.model.options, self.model.pipeline.names)
         elif self.view.is_complete():
             self.model.run_process()
             self.model.save_batch()